@@ -4,7 +4,19 @@ __version__ = "0.3.0"
 
 __author__ = "Giovanni Pizzi, Austin Zadoks"
 
-from .base import BaseSubmissionController
+from .base import BaseSubmissionController, StatusSnapshot
+from .events import BroadcastTerminationEvents, ProcessTerminationEvents
 from .from_group import FromGroupSubmissionController
+from .metrics import JsonLinesSink, PrometheusTextfileSink
+from .orchestrator import SubmissionOrchestrator
 
-__all__ = ("BaseSubmissionController", "FromGroupSubmissionController")
+__all__ = (
+    "BaseSubmissionController",
+    "BroadcastTerminationEvents",
+    "FromGroupSubmissionController",
+    "JsonLinesSink",
+    "PrometheusTextfileSink",
+    "ProcessTerminationEvents",
+    "StatusSnapshot",
+    "SubmissionOrchestrator",
+)
@@ -1,18 +1,41 @@
 # -*- coding: utf-8 -*-
 """A prototype class to submit processes in batches, avoiding to submit too many."""
 import abc
+import asyncio
+import collections
+import contextlib
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import os
+import signal
+import socket
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Literal, Optional
 
 from aiida import engine, orm
-from aiida.common import NotExistent
-from pydantic import BaseModel, field_validator
+from aiida.common import IntegrityError, NotExistent, timezone
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_validator
 from rich import print
 from rich.console import Console
 from rich.table import Table
 
+from .cache import PreparedInputsCache
+from .journal import SubmissionJournal
+from .metrics import CycleMetrics
+from .rate_limit import TokenBucket
+
 CMDLINE_LOGGER = logging.getLogger("verdi")
 
+QUERY_CHUNK_SIZE = 500
+"""Maximum number of items whose filters are combined in a single query."""
+
 
 def get_extras_dict(extras_keys, workchain_extras):
     """Return a dictionary of extras from a list of keys and a list of values."""
@@ -33,6 +56,85 @@ def get_extras_dict(extras_keys, workchain_extras):
     return extras_dict
 
 
+def run_polling_loop(
+    submit_batch,
+    is_done,
+    stop_event,
+    poll_interval,
+    max_poll_interval,
+    backoff_factor,
+    events=None,
+    is_relevant=None,
+    event_debounce=1.0,
+):
+    """Call ``submit_batch`` repeatedly, waiting in between, until ``stop_event`` is set or there is nothing left to do.
+
+    When a cycle does not submit anything, the waiting time is multiplied by ``backoff_factor``, up to
+    ``max_poll_interval``; it is reset to ``poll_interval`` as soon as new processes are submitted. ``SIGINT`` and
+    ``SIGTERM`` set the ``stop_event``, so that the loop stops cleanly after the current cycle.
+
+    :param submit_batch: a callable submitting a new batch and returning what it submitted.
+    :param is_done: a callable returning whether there is nothing left to do. It is only called after cycles that did
+        not submit anything.
+    :param stop_event: a ``threading.Event`` that stops the loop when set.
+    :param events: an optional ``ProcessTerminationEvents``. The wait is then interrupted as soon as a relevant process
+        terminates, the polling interval only serving to reconcile missed events.
+    :param is_relevant: a callable returning whether a terminated process, given its PK, frees a slot.
+    :param event_debounce: seconds to wait after a relevant termination event, to group the ones arriving together
+        and to let the processes be sealed, before submitting a new batch.
+    """
+    stop_event.clear()
+
+    def request_stop(signum, _):
+        CMDLINE_LOGGER.report(f"Received signal {signal.Signals(signum).name}: stopping after the current cycle.")
+        stop_event.set()
+
+    previous_handlers = {}
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    try:
+        interval = poll_interval
+        while not stop_event.is_set():
+            submitted = submit_batch()
+
+            if submitted:
+                interval = poll_interval
+            else:
+                if is_done():
+                    CMDLINE_LOGGER.report("All processes have been submitted and completed: stopping.")
+                    break
+                interval = min(interval * backoff_factor, max(max_poll_interval, poll_interval))
+
+            wait_for_events(events, is_relevant, stop_event, interval, event_debounce)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def wait_for_events(events, is_relevant, stop_event, timeout, debounce):
+    """Wait for ``timeout`` seconds, or less if ``stop_event`` is set or a relevant process terminates.
+
+    See ``run_polling_loop()`` for the parameters.
+    """
+    if events is None:
+        stop_event.wait(timeout)
+        return
+
+    deadline = time.monotonic() + timeout
+    while not stop_event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        # Wake up regularly to check the ``stop_event``
+        pks = events.wait(min(remaining, 1.0))
+        if any(is_relevant(pk) for pk in pks):
+            stop_event.wait(debounce)
+            return
+
+
 def validate_group_exists(value: str) -> str:
     """Validator that makes sure the ``Group`` with the provided label exists."""
     try:
@@ -43,6 +145,51 @@ def validate_group_exists(value: str) -> str:
         return value
 
 
+class StatusSnapshot(BaseModel):
+    """Status of a submission controller at a given time.
+
+    It is computed once per batch submission and used both to decide what to submit and to report the status.
+    """
+
+    num_total: Optional[int]
+    """Number of processes that should be run in total (``None`` in streaming mode)."""
+    num_already_run: int
+    """Number of processes that have already been submitted (and might or might not have finished)."""
+    num_to_run: Optional[int]
+    """Number of processes that still have to be submitted (``None`` in streaming mode)."""
+    num_to_retry: int = 0
+    """Number of failed processes that can be resubmitted now (see ``max_attempts``)."""
+    max_concurrent: int
+    """Maximum concurrent active processes."""
+    effective_max_concurrent: int
+    """Maximum concurrent active processes currently allowed by the adaptive concurrency (see ``adaptive_concurrency``),
+    or ``max_concurrent`` if it is not enabled."""
+    num_active_slots: int
+    """Number of processes in the group that are active (unsealed)."""
+    num_available_slots: int
+    """Number of processes that can be submitted in the next batch."""
+    num_active_per_resource: dict = Field(default_factory=dict)
+    """Number of active processes for each of the resources in ``max_concurrent_per_resource``."""
+    extras_to_run: Any = Field(default_factory=list, exclude=True, repr=False)
+    """Extras of the processes that still have to be submitted: a list, or an iterator in streaming mode."""
+    extras_to_retry: list = Field(default_factory=list, exclude=True, repr=False)
+    """Extras of the failed processes that can be resubmitted now."""
+
+    def count_candidates(self, limit):
+        """Return the number of processes that can be submitted or resubmitted, counting at most ``limit`` of them.
+
+        In streaming mode, up to ``limit`` extras are taken from ``extras_to_run`` to count them, and put back in front
+        of the remaining ones, so that the snapshot can still be used to submit a batch.
+        """
+        num_to_retry = min(limit, len(self.extras_to_retry))
+        if self.num_to_run is not None:
+            return min(limit, num_to_retry + self.num_to_run)
+        extras_to_run = iter(self.extras_to_run)
+        head = list(itertools.islice(extras_to_run, limit - num_to_retry))
+        self.extras_to_run = itertools.chain(head, extras_to_run)
+        return num_to_retry + len(head)
+
+
 class BaseSubmissionController(BaseModel):
     """Controller to submit a maximum number of processes (workflows or calculations) at a given time.
 
@@ -55,15 +202,203 @@ class BaseSubmissionController(BaseModel):
     """Maximum concurrent active processes."""
     unique_extra_keys: tuple
     """Tuple of keys defined in the extras that uniquely define each process to be run."""
+    full_rescan_interval: Optional[float] = 600.0
+    """Number of seconds after which the index of submitted processes is rebuilt from the full group.
+
+    In between, only processes with a PK higher than the highest one seen so far are queried. The full rescan takes
+    care of processes that were deleted or that were added to the group after being created. Set to ``None`` to rescan
+    the full group every time.
+    """
+    bookkeeping_chunk_size: int = 1
+    """Number of submitted processes for which the extras are set and the group membership is added at once.
+
+    The bookkeeping of each chunk is done in a single transaction. Pending processes are always committed before the
+    batch submission returns, also when it is interrupted by an exception. If the controller is killed before (e.g. by
+    ``SIGKILL`` or by running out of memory), the submitted processes are not found in the group and would be submitted
+    again, unless ``journal_path`` is set: chunks larger than one therefore require a journal.
+    """
+    journal_path: Optional[str] = None
+    """Path of a file where each submission is recorded before its bookkeeping is committed, or ``None``.
+
+    When the controller starts, the processes that were submitted but whose extras were not set, or that were not added
+    to the group (e.g. because the controller was killed), are repaired in bulk from the journal, rather than being
+    submitted again. The file is compacted whenever it grows larger than 1 MiB. See ``SubmissionJournal``.
+    """
+    streaming: bool = False
+    """Consume the extras returned by ``get_all_extras_to_submit()`` lazily, e.g. from a generator.
+
+    Each candidate is checked against the submitted processes as it is produced, and no more candidates are requested
+    once the available slots are filled. The total number of processes and the number left to run are then not
+    computed when submitting a batch, and sorting is not supported.
+    """
+    preparation_workers: int = 0
+    """Number of threads calling ``prepare_inputs()`` concurrently, ahead of the submissions.
+
+    The inputs are still built, and the processes submitted, one after the other in the main thread. Zero means that
+    ``prepare_inputs()`` is called in the main thread as well, just before building the inputs.
+    """
+    prepared_inputs_cache_size: int = 0
+    """Maximum number of values returned by ``prepare_inputs()`` that are cached, or zero to disable the cache.
+
+    Cached values are reused when a submission fails, or when the controller is interrupted, instead of being prepared
+    again. They are dropped once the process is submitted. See also ``prepare_ahead()``.
+    """
+    prepared_inputs_cache_ttl: Optional[float] = None
+    """Number of seconds after which a cached value returned by ``prepare_inputs()`` expires, or ``None``."""
+    prepared_inputs_cache_dir: Optional[str] = None
+    """Directory where the values returned by ``prepare_inputs()`` are cached, so that they survive a restart.
+
+    The values are pickled, so they must be picklable. If ``None``, they are cached in memory.
+    """
+    max_submission_rate: Optional[float] = None
+    """Maximum average number of submissions per second, or ``None`` for no limit.
+
+    While waiting for the next submission to be allowed, the inputs of the following processes keep being prepared and
+    the bookkeeping of the submitted ones is committed.
+    """
+    submission_burst: int = 1
+    """Number of submissions that can be performed at once, without waiting, when ``max_submission_rate`` is set."""
+    metrics_sink: Optional[Callable[[dict], None]] = None
+    """Callable receiving the timings and counters of each batch submission, as a dictionary.
+
+    See ``CycleMetrics.as_dict()`` for its content, and ``JsonLinesSink`` and ``PrometheusTextfileSink`` for sinks
+    writing them to a file.
+    """
+    max_concurrent_per_resource: Optional[dict] = None
+    """Maximum concurrent active processes for each resource, on top of the global ``max_concurrent``.
+
+    The keys are the resource keys returned by ``get_resource_key()``, e.g. the label of a computer or of a code.
+    Processes whose resource key is not in the dictionary are only limited by ``max_concurrent``. With several shards,
+    each limit is split between them like ``max_concurrent`` (see ``shard_max_concurrent_per_resource``).
+    """
+    max_attempts: int = 1
+    """Maximum number of times a process with the same unique extras is submitted, if it fails.
+
+    A process has failed if it was excepted or killed, or if it finished with one of the ``retry_exit_codes``. It is
+    then submitted again with the same extras, and with the number of the attempt in the ``attempt_extra_key`` extra.
+    The default of one means that failed processes are never resubmitted.
+    """
+    retry_exit_codes: Optional[List[int]] = None
+    """Exit statuses of finished processes that are resubmitted, or ``None`` to resubmit any non-zero exit status."""
+    retry_backoff: float = 0.0
+    """Number of seconds to wait after the failure of the first attempt before resubmitting a process.
+
+    The waiting time is multiplied by ``retry_backoff_factor`` for every further attempt.
+    """
+    retry_backoff_factor: float = 2.0
+    """Factor by which ``retry_backoff`` is multiplied after every failed attempt."""
+    retry_policy: Literal["first", "last"] = "first"
+    """Whether the failed processes to resubmit get the available slots before (``first``) or after (``last``) the
+    processes that were never submitted."""
+    attempt_extra_key: str = "submission_controller_attempt"
+    """Key of the extra storing the number of the attempt on resubmitted processes (it is absent on the first one)."""
+    identity_extra_key: Optional[str] = None
+    """Key of an extra storing a single hash of the unique extras on each submitted process, or ``None``.
+
+    When set, the index of submitted processes is built by projecting this single short string, rather than one JSON
+    value per unique extra, and candidates are compared through their hash (see ``get_identity()``). Processes
+    submitted before this was set, that do not have the extra, are still found through their unique extras (see also
+    ``backfill_identity_extras()``). On PostgreSQL, an index on the extra can speed up the queries further.
+    """
+    num_shards: int = 1
+    """Number of controllers sharing the same group, e.g. on different machines, each with a different ``shard_index``.
+
+    Each controller only submits the processes whose unique extras hash (see ``get_identity()``) to its own shard, and
+    only counts the active processes of its own shard, against its share of ``max_concurrent`` and of the limits in
+    ``max_concurrent_per_resource``.
+    """
+    shard_index: int = 0
+    """Index of the shard of this controller, between zero and ``num_shards - 1``."""
+    claim_submissions: bool = False
+    """Claim each process in the database before submitting it, so that it is never submitted twice.
+
+    A claim is a group with a label derived from ``group_label`` and from the hash of the unique extras (and of the
+    attempt, see ``max_attempts``): since group labels are unique, only one controller can create it. Its extras record
+    the controller that owns it. Once the claim is acquired, the group is checked for a process that another controller
+    submitted in the meantime, and the claim is deleted as soon as the bookkeeping of the process is committed, or if
+    the submission fails. This protects against controllers with overlapping shards or with an outdated index of the
+    submitted processes, at the cost of a few more queries per submission.
+    """
+    claim_ttl: float = 3600.0
+    """Number of seconds after which a claim whose process is still not in the group is stale.
+
+    This happens when the controller owning the claim was killed before submitting the process or committing its
+    bookkeeping. A stale claim is taken over by the next controller trying to submit the same process.
+    """
+    adaptive_concurrency: bool = False
+    """Adapt the number of concurrent active processes to the load of the daemon, up to ``max_concurrent``.
+
+    The limit is increased by ``adaptive_increase`` after every batch for which all slots were used and no congestion
+    was measured (see ``is_congested()``), and multiplied by ``adaptive_decrease_factor`` when there is congestion.
+    """
+    adaptive_increase: int = 1
+    """Number of slots added to the adaptive limit after a batch without congestion."""
+    adaptive_decrease_factor: float = 0.5
+    """Factor by which the adaptive limit is multiplied when there is congestion."""
+    min_concurrent: int = 1
+    """Lower bound of the adaptive limit."""
+    max_queue_latency: float = 120.0
+    """Number of seconds after which an active process that is still in the ``created`` state signals congestion."""
 
     _validate_group_exists = field_validator("group_label")(validate_group_exists)
 
+    @model_validator(mode="after")
+    def _check_shard(self):
+        """Check that the shard index is within the number of shards."""
+        if self.num_shards < 1:
+            raise ValueError("There must be at least one shard.")
+        if not 0 <= self.shard_index < self.num_shards:
+            raise ValueError(f"The shard index must be between 0 and {self.num_shards - 1}, got {self.shard_index}.")
+        return self
+
+    @model_validator(mode="after")
+    def _check_bookkeeping_chunk_size(self):
+        """Check that processes can only be left without bookkeeping if they are recorded in a journal."""
+        if self.bookkeeping_chunk_size < 1:
+            raise ValueError("The bookkeeping chunk size must be at least 1.")
+        if self.bookkeeping_chunk_size > 1 and self.journal_path is None:
+            raise ValueError(
+                "A bookkeeping chunk size larger than 1 requires `journal_path` to be set, so that the processes "
+                "submitted in a chunk that was not committed are not submitted again."
+            )
+        return self
+
+    _submitted_index: dict = PrivateAttr(default_factory=dict)
+    _submitted_max_pk: int = PrivateAttr(default=0)
+    _submitted_pks: dict = PrivateAttr(default_factory=dict)
+    _last_full_rescan: Optional[float] = PrivateAttr(default=None)
+    _stop_event: threading.Event = PrivateAttr(default_factory=threading.Event)
+    _group: Optional[tuple] = PrivateAttr(default=None)
+    _active_pks: set = PrivateAttr(default_factory=set)
+    _active_max_pk: int = PrivateAttr(default=0)
+    _last_active_rescan: Optional[float] = PrivateAttr(default=None)
+    _active_pks_seeded: bool = PrivateAttr(default=False)
+    _prepared_inputs: dict = PrivateAttr(default_factory=dict)
+    _rate_limiter: Optional[TokenBucket] = PrivateAttr(default=None)
+    _prepared_inputs_cache: Optional[PreparedInputsCache] = PrivateAttr(default=None)
+    _metrics: Optional[CycleMetrics] = PrivateAttr(default=None)
+    _failed: dict = PrivateAttr(default_factory=dict)
+    _failed_rescan_marker: Optional[float] = PrivateAttr(default=None)
+    _last_failed_check: Optional[datetime.datetime] = PrivateAttr(default=None)
+    _adaptive_limit: Optional[float] = PrivateAttr(default=None)
+    _last_decrease: Optional[datetime.datetime] = PrivateAttr(default=None)
+    _active_extras: dict = PrivateAttr(default_factory=dict)
+    _journal: Optional[SubmissionJournal] = PrivateAttr(default=None)
+    _journal_repaired: bool = PrivateAttr(default=False)
+    _leftover_candidates: Optional[tuple] = PrivateAttr(default=None)
+    _claims: dict = PrivateAttr(default_factory=dict)
+    _claim_owner: str = PrivateAttr(
+        default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    )
+
     @property
     def group(self):
         """Return the AiiDA ORM Group instance that is managed by this class."""
-        return orm.Group.collection.get(label=self.group_label)
+        if self._group is None or self._group[0] != self.group_label:
+            self._group = (self.group_label, orm.Group.collection.get(label=self.group_label))
+        return self._group[1]
 
-    def get_query(self, process_projections, only_active=False):
+    def get_query(self, process_projections, only_active=False, process_filters=None):
         """Return a QueryBuilder object to get all processes in the group associated to this.
 
         Projections on the process must be specified.
@@ -73,6 +408,7 @@ class BaseSubmissionController(BaseModel):
 
         :param process_projections: a list of projections for the ProcessNode.
         :param only_active: if True, will filter only on active (not-sealed) processes.
+        :param process_filters: optional additional filters on the ProcessNode.
         """
         qbuild = orm.QueryBuilder()
         filters = {}
@@ -83,6 +419,8 @@ class BaseSubmissionController(BaseModel):
                     {"attributes": {"!has_key": "sealed"}},
                 ]
             }
+        if process_filters:
+            filters = {"and": [filters, process_filters]} if filters else process_filters
 
         qbuild.append(orm.Group, filters={"label": self.group_label}, tag="group")
         qbuild.append(
@@ -104,29 +442,203 @@ class BaseSubmissionController(BaseModel):
         """
         return [f"extras.{unique_key}" for unique_key in self.get_extra_unique_keys()]
 
-    def get_all_submitted_pks(self):
+    def get_all_submitted_pks(self, full_rescan=False):
         """Return a dictionary of all processes that have been already submitted (i.e., are in the group).
 
         :return: a dictionary where:
 
             - the keys are the tuples with the values of extras that uniquely identifies processes, in the same
-              order as returned by get_extra_unique_keys().
+              order as returned by get_extra_unique_keys(). If ``identity_extra_key`` is set, the keys are instead
+              their hashes, as returned by ``get_identity()``.
 
             - the values are the corresponding process PKs.
 
-        :note: this returns all processes, both active and completed (sealed).
+        :note: this returns all processes, both active and completed (sealed). If a process was resubmitted, only the
+            latest attempt is returned.
+
+        :param full_rescan: if True, rebuild the index from the full group rather than only querying processes that
+            were added since the last call. See ``full_rescan_interval``.
         """
-        projections = self.get_process_extra_projections() + ["id"]
+        return dict(self._update_submitted_index(full_rescan=full_rescan))
 
-        qbuild = self.get_query(only_active=False, process_projections=projections)
-        all_submitted = {}
-        for data in qbuild.all():
+    def _update_submitted_index(self, full_rescan=False):
+        """Update the index of submitted processes and return it.
+
+        Only the processes with a PK higher than the highest one that was already seen are queried, unless a full
+        rescan is requested or ``full_rescan_interval`` has elapsed since the last one.
+        """
+        now = time.monotonic()
+        if (
+            full_rescan
+            or self._last_full_rescan is None
+            or self.full_rescan_interval is None
+            or now - self._last_full_rescan >= self.full_rescan_interval
+        ):
+            self._submitted_index = {}
+            self._submitted_pks = {}
+            self._submitted_max_pk = 0
+            self._last_full_rescan = now
+
+        process_filters = {"id": {">": self._submitted_max_pk}} if self._submitted_max_pk else None
+
+        if self.identity_extra_key is None:
+            rows = self._get_submitted_extras_rows(process_filters)
+        else:
+            identity_projection = f"extras.{self.identity_extra_key}"
+            identity_filters = {"extras": {"has_key": self.identity_extra_key}}
+            qbuild = self.get_query(
+                process_projections=[identity_projection, "id"],
+                process_filters={"and": [process_filters, identity_filters]} if process_filters else identity_filters,
+            )
+            rows = qbuild.all()
+            # Processes submitted before ``identity_extra_key`` was set only have the unique extras
+            legacy_filters = {"extras": {"!has_key": self.identity_extra_key}}
+            legacy_rows = self._get_submitted_extras_rows(
+                {"and": [process_filters, legacy_filters]} if process_filters else legacy_filters
+            )
+            rows += [
+                (self.get_identity(data[:-1]), data[-1])
+                for data in legacy_rows
+                if all(extra is not None for extra in data[:-1])
+            ]
+
+        self._count_metric("submitted_index_rows", len(rows))
+        for data in rows:
+            self._submitted_max_pk = max(self._submitted_max_pk, data[-1])
             # Skip nodes without (all of) the right extras
             if any(extra is None for extra in data[:-1]):
                 continue
-            all_submitted[tuple(data[:-1])] = data[-1]
+            key = tuple(data[:-1]) if self.identity_extra_key is None else data[0]
+            # Keep the latest attempt, if a process was resubmitted
+            if data[-1] > self._submitted_index.get(key, 0):
+                self._submitted_index[key] = data[-1]
+            self._submitted_pks[data[-1]] = key
 
-        return all_submitted
+        return self._submitted_index
+
+    def _get_submitted_extras_rows(self, process_filters=None):
+        """Return the values of the unique extras, followed by the PK, of the processes in the group."""
+        projections = self.get_process_extra_projections() + ["id"]
+        return self.get_query(process_projections=projections, process_filters=process_filters).all()
+
+    def get_identity(self, extras_values):
+        """Return the hash identifying the process with the given unique extras, when ``identity_extra_key`` is set.
+
+        It is the SHA-256 of the canonical JSON representation of the values of the extras, so it does not depend on
+        the order of the keys of dictionaries, nor on lists having been converted to tuples.
+        """
+        serialized = json.dumps(list(extras_values), sort_keys=True, separators=(",", ":"), ensure_ascii=True)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _in_shard(self, extras_values=None, key=None):
+        """Return whether the process with the given extras, or index key (see ``_index_key()``), is in this shard."""
+        if self.num_shards == 1:
+            return True
+        if key is None:
+            identity = self.get_identity(extras_values)
+        else:
+            identity = key if self.identity_extra_key is not None else self.get_identity(key)
+        return int(identity[:16], 16) % self.num_shards == self.shard_index
+
+    def _get_shard_active_pks(self):
+        """Return the PKs of the active processes in the group that belong to this shard.
+
+        Processes that are not in the index of submitted processes (e.g. whose bookkeeping was not committed yet) are
+        not counted.
+        """
+        if self.num_shards == 1:
+            return self._active_pks
+        return {
+            pk for pk in self._active_pks if pk in self._submitted_pks and self._in_shard(key=self._submitted_pks[pk])
+        }
+
+    def _claim(self, extras_values):
+        """Claim the submission of the process with the given extras in the database (see ``claim_submissions``).
+
+        :return: True if the claim succeeded, or False if the process was claimed or submitted by another controller.
+        """
+        label = f"{self.group_label}/claims/{self.get_identity(extras_values)}"
+        if extras_values in self._failed:
+            label += f"/{self._failed[extras_values][1] + 1}"
+
+        # A second attempt is only needed after releasing a stale claim
+        for _ in range(2):
+            try:
+                claim = orm.Group(
+                    label=label, extras={"owner": self._claim_owner, "claimed_at": timezone.now().isoformat()}
+                ).store()
+            except IntegrityError:
+                try:
+                    existing = orm.Group.collection.get(label=label)
+                except NotExistent:
+                    continue
+                owner = existing.base.extras.get("owner", "an unknown controller")
+                age = (timezone.now() - existing.time).total_seconds()
+                if age < self.claim_ttl:
+                    CMDLINE_LOGGER.report(
+                        f"Extras <{extras_values}> were claimed by {owner} {age:.0f} seconds ago: skipping."
+                    )
+                    return False
+                if self._is_submitted_elsewhere(extras_values):
+                    # The bookkeeping was committed, but the claim was not released
+                    self._release_claim(existing.pk)
+                    CMDLINE_LOGGER.report(f"Extras <{extras_values}> were already submitted by {owner}: skipping.")
+                    return False
+                CMDLINE_LOGGER.report(f"Taking over the stale claim of {owner} on extras <{extras_values}>.")
+                self._release_claim(existing.pk)
+                continue
+
+            if self._is_submitted_elsewhere(extras_values):
+                self._release_claim(claim.pk)
+                CMDLINE_LOGGER.report(
+                    f"Extras <{extras_values}> were already submitted by another controller: skipping."
+                )
+                return False
+            self._claims[extras_values] = claim.pk
+            return True
+
+        return False
+
+    def _is_submitted_elsewhere(self, extras_values):
+        """Return whether the group contains a process for the given extras that is not in the index yet."""
+        process_filters = dict(zip(self.get_process_extra_projections(), extras_values))
+        known_pk = self._submitted_index.get(self._index_key(extras_values))
+        if known_pk is not None:
+            process_filters["id"] = {">": known_pk}
+        return self.get_query(process_projections=["id"], process_filters=process_filters).first() is not None
+
+    @staticmethod
+    def _release_claim(pk):
+        """Delete the claim group with the given PK, if it still exists."""
+        if orm.QueryBuilder().append(orm.Group, filters={"id": pk}).count():
+            orm.Group.collection.delete(pk)
+
+    def _index_key(self, extras_values):
+        """Return the key of the given extras in the index of submitted processes."""
+        if self.identity_extra_key is None:
+            return extras_values
+        return self.get_identity(extras_values)
+
+    def backfill_identity_extras(self):
+        """Set the ``identity_extra_key`` extra on the processes of the group that were submitted without it.
+
+        The extras are set in a single transaction. This is not needed for the controller to work, but it makes the
+        queries of the index of submitted processes cheaper.
+
+        :return: the number of processes that were updated.
+        """
+        if self.identity_extra_key is None:
+            raise ValueError("Backfilling the identity extras requires `identity_extra_key` to be set.")
+
+        qbuild = self.get_query(
+            process_projections=self.get_process_extra_projections() + ["*"],
+            process_filters={"extras": {"!has_key": self.identity_extra_key}},
+        )
+        rows = [data for data in qbuild.all() if all(extra is not None for extra in data[:-1])]
+        with self.group.backend.transaction():
+            for data in rows:
+                data[-1].base.extras.set(self.identity_extra_key, self.get_identity(data[:-1]))
+        return len(rows)
 
     def get_all_submitted_processes(self, only_active=False):
         """Return a dictionary of all processes that have been already submitted (i.e., are in the group).
@@ -138,117 +650,1231 @@ class BaseSubmissionController(BaseModel):
 
             - the values are the corresponding AiiDA ProcessNode instances.
 
-        :note: this returns all processes, both active and completed (sealed).
+        :note: this returns all processes, both active and completed (sealed). If a process was resubmitted, only the
+            latest attempt is returned.
+        :note: this loads all processes in memory; for large groups, use ``iter_submitted_process_rows()`` to only
+            fetch the needed properties.
         """
         projections = self.get_process_extra_projections() + ["*"]
 
         qbuild = self.get_query(only_active=only_active, process_projections=projections)
+        # If a process was resubmitted, the latest attempt comes last and is the one that is kept
+        qbuild.order_by({"process": {"id": "asc"}})
         all_submitted = {}
         for data in qbuild.all():
             all_submitted[tuple(data[:-1])] = data[-1]
 
         return all_submitted
 
+    def iter_submitted_process_rows(
+        self,
+        projections=("attributes.process_state", "attributes.exit_status"),
+        output_projections=None,
+        only_active=False,
+        batch_size=QUERY_CHUNK_SIZE,
+    ):
+        """Iterate over lightweight records of the processes that have been already submitted.
+
+        Contrary to ``get_all_submitted_processes()``, no ORM node is loaded: only the requested projections are
+        returned, and the processes are fetched in pages of ``batch_size`` rows (ordered by PK), so that memory usage
+        does not scale with the size of the group.
+
+        :param projections: a list of QueryBuilder projections on the ProcessNode, e.g. ``"id"``, ``"ctime"``,
+            ``"attributes.process_state"`` or ``"attributes.exit_status"``.
+        :param output_projections: an optional dictionary where the keys are link labels of outputs of the process,
+            and the values are lists of projections on the corresponding output node, e.g.
+            ``{"sum": ["attributes.value"]}``. Values of missing outputs are returned as ``None``.
+        :param only_active: if True, will only return the active (not-sealed) processes.
+        :param batch_size: the number of processes fetched per query.
+        :return: a generator of tuples ``(extras, row)``, where ``extras`` is the tuple of the values of the unique
+            extras (in the same order as returned by get_extra_unique_keys()) and ``row`` is the tuple of the values of
+            ``projections``, followed by the values of ``output_projections`` (in order).
+        """
+        projections = list(projections)
+        output_projections = output_projections or {}
+        num_extras = len(self.get_extra_unique_keys())
+        process_projections = self.get_process_extra_projections() + projections
+        if "id" not in projections:
+            process_projections.append("id")
+        pk_index = process_projections.index("id")
+
+        last_pk = 0
+        while True:
+            qbuild = self.get_query(
+                process_projections=process_projections,
+                only_active=only_active,
+                process_filters={"id": {">": last_pk}},
+            )
+            qbuild.order_by({"process": {"id": "asc"}}).limit(batch_size)
+            page = qbuild.all()
+            if not page:
+                return
+            last_pk = page[-1][pk_index]
+
+            outputs = self._get_output_values([data[pk_index] for data in page], output_projections)
+            for data in page:
+                row = tuple(data[num_extras : num_extras + len(projections)])
+                for link_label, link_projections in output_projections.items():
+                    row += outputs.get((data[pk_index], link_label), (None,) * len(link_projections))
+                yield tuple(data[:num_extras]), row
+
+            if len(page) < batch_size:
+                return
+
+    @staticmethod
+    def _get_output_values(process_pks, output_projections):
+        """Return the projected values of the outputs of the given processes.
+
+        :param process_pks: a list of PKs of processes.
+        :param output_projections: a dictionary with link labels as keys and lists of projections as values.
+        :return: a dictionary where the keys are tuples ``(process_pk, link_label)`` and the values are the tuples of
+            projected values of the corresponding output.
+        """
+        values = {}
+        for link_label, link_projections in output_projections.items():
+            # An outer join would not return the processes without this output, since the filter on the link label
+            # applies to the whole row, so the outputs are fetched in a separate query
+            qbuild = orm.QueryBuilder()
+            qbuild.append(orm.ProcessNode, filters={"id": {"in": process_pks}}, project=["id"], tag="process")
+            qbuild.append(
+                orm.Node,
+                with_incoming="process",
+                edge_filters={"label": link_label},
+                project=list(link_projections),
+            )
+            for data in qbuild.iterall():
+                values[(data[0], link_label)] = tuple(data[1:])
+        return values
+
+    def has_submitted(self, pk):
+        """Return whether the process with the given PK is in the index of processes submitted by this controller."""
+        return pk in self._submitted_pks
+
     def _check_submitted_extras(self):
-        """Return a set with the extras of the processes tha have been already submitted."""
-        return set(self.get_all_submitted_pks().keys())
+        """Return a set with the extras of the processes tha have been already submitted.
+
+        If ``identity_extra_key`` is set, it contains their hashes instead: see ``_index_key()``.
+        """
+        return self._update_submitted_index().keys()
+
+    def get_failed_filters(self):
+        """Return the QueryBuilder filters on the process that select the failed processes to resubmit.
+
+        These are the excepted and killed processes, and the finished ones with one of the ``retry_exit_codes`` (or any
+        non-zero exit status, if not set).
+        """
+        exit_status_filter = {">": 0} if self.retry_exit_codes is None else {"in": list(self.retry_exit_codes)}
+        return {
+            "or": [
+                {"attributes.process_state": {"in": ["excepted", "killed"]}},
+                {"and": [{"attributes.process_state": "finished"}, {"attributes.exit_status": exit_status_filter}]},
+            ]
+        }
+
+    def _update_failed_index(self):
+        """Update the failed processes that should be resubmitted and return them.
+
+        Only the processes that were modified since the previous call (with a margin for the clock skew with the daemon
+        workers) are queried, so that the cost does not scale with the size of the group. The whole group is checked
+        again whenever the index of submitted processes is rebuilt, so this must be called after updating it.
+
+        :return: a dictionary where the keys are the extras of the failed processes, and the values are tuples
+            ``(pk, attempt, retry_time)`` of the latest attempt, with the time after which it can be resubmitted.
+        """
+        if self.max_attempts <= 1:
+            return self._failed
+
+        process_filters = self.get_failed_filters()
+        if self._failed_rescan_marker != self._last_full_rescan or self._last_failed_check is None:
+            self._failed = {}
+            self._failed_rescan_marker = self._last_full_rescan
+        else:
+            since = self._last_failed_check - datetime.timedelta(seconds=60)
+            process_filters = {"and": [process_filters, {"mtime": {">=": since}}]}
+        self._last_failed_check = timezone.now()
+
+        self._failed.update(self._query_failed(process_filters))
+
+        # Drop the failed processes that have been resubmitted since they were found, e.g. by another controller
+        for extras_values, (pk, _, _) in list(self._failed.items()):
+            if self._submitted_index.get(self._index_key(extras_values)) != pk:
+                del self._failed[extras_values]
+
+        return self._failed
+
+    def _query_failed(self, process_filters):
+        """Return the failed processes selected by the given filters that should be resubmitted.
+
+        :return: a dictionary as returned by ``_update_failed_index()``.
+        """
+        failed = {}
+        projections = self.get_process_extra_projections() + ["id", f"extras.{self.attempt_extra_key}", "mtime"]
+        qbuild = self.get_query(process_projections=projections, process_filters=process_filters)
+        for data in qbuild.iterall():
+            extras_values = tuple(data[:-3])
+            pk, attempt, mtime = data[-3:]
+            attempt = attempt or 1
+            # Skip processes that have been resubmitted already, or that should not be resubmitted anymore
+            if (
+                self._submitted_index.get(self._index_key(extras_values)) != pk
+                or attempt >= self.max_attempts
+                or not self._in_shard(extras_values)
+            ):
+                continue
+            backoff = self.retry_backoff * self.retry_backoff_factor ** (attempt - 1)
+            failed[extras_values] = (pk, attempt, mtime + datetime.timedelta(seconds=backoff))
+        return failed
+
+    def _get_extras_to_retry(self, failed=None):
+        """Return the extras of the failed processes whose waiting time before resubmission has elapsed.
+
+        :param failed: a dictionary of failed processes as returned by ``_update_failed_index()``. By default, the
+            index of the controller.
+        """
+        now = timezone.now()
+        failed = self._failed if failed is None else failed
+        return [extras_values for extras_values, (_, _, retry_time) in failed.items() if retry_time <= now]
+
+    def _update_active_pks(self, full_rescan=False):
+        """Update the set of PKs of the active (unsealed) processes in the group and return it.
+
+        Rather than filtering all processes in the group on their ``sealed`` attribute, only the processes that were
+        active at the previous call are checked again, together with the processes with a PK higher than the highest
+        one seen so far. The cost therefore scales with the number of active processes, rather than with the size of
+        the group. The full group is checked again every ``full_rescan_interval`` seconds, or if ``full_rescan`` is
+        True.
+        """
+        if self._active_pks_seeded and not full_rescan:
+            self._active_pks_seeded = False
+            return self._active_pks
+
+        now = time.monotonic()
+        if (
+            full_rescan
+            or self._last_active_rescan is None
+            or self.full_rescan_interval is None
+            or now - self._last_active_rescan >= self.full_rescan_interval
+        ):
+            qbuild = self.get_query(process_projections=["id"])
+            qbuild.order_by({"process": {"id": "desc"}}).limit(1)
+            self._active_max_pk = qbuild.first(flat=True) or 0
+            self._active_pks = set(self.get_query(process_projections=["id"], only_active=True).all(flat=True))
+            self._last_active_rescan = now
+            self._count_metric("active_rows", len(self._active_pks))
+            return self._active_pks
+
+        known_active = list(self._active_pks)
+        still_active = set()
+        for start in range(0, len(known_active), QUERY_CHUNK_SIZE):
+            qbuild = self.get_query(
+                process_projections=["id"],
+                only_active=True,
+                process_filters={"id": {"in": known_active[start : start + QUERY_CHUNK_SIZE]}},
+            )
+            still_active.update(qbuild.all(flat=True))
+
+        qbuild = self.get_query(
+            process_projections=["id", "attributes.sealed"], process_filters={"id": {">": self._active_max_pk}}
+        )
+        new_processes = qbuild.all()
+        self._count_metric("active_rows", len(still_active) + len(new_processes))
+        for pk, sealed in new_processes:
+            self._active_max_pk = max(self._active_max_pk, pk)
+            if not sealed:
+                still_active.add(pk)
+
+        self._active_pks = still_active
+        return self._active_pks
+
+    @property
+    def active_pks(self):
+        """PKs of the active processes in the group, as of the last time they were counted."""
+        return frozenset(self._active_pks)
+
+    @property
+    def shard_active_pks(self):
+        """PKs of the active processes in the group that belong to the shard of this controller (see ``num_shards``)."""
+        return frozenset(self._get_shard_active_pks())
+
+    @property
+    def active_max_pk(self):
+        """PK above which the processes in the group were not checked yet when counting the active ones."""
+        return self._active_max_pk
+
+    def seed_active_pks(self, active_pks, max_pk, full_rescan=False):
+        """Set the PKs of the active processes in the group, as obtained by a query done outside of this controller.
+
+        The next count of the active processes (e.g. for the next batch) returns them without querying the database.
+        This lets an orchestrator count the active processes of several controllers with the same queries: see
+        ``SubmissionOrchestrator``.
+
+        :param active_pks: the PKs of the active processes in the group.
+        :param max_pk: a PK such that all processes in the group with a higher PK are not in ``active_pks`` yet.
+        :param full_rescan: whether ``active_pks`` come from a check of the full group.
+        """
+        self._active_pks = set(active_pks)
+        self._active_max_pk = max_pk
+        if full_rescan:
+            self._last_active_rescan = time.monotonic()
+        self._active_pks_seeded = True
 
     def _count_active_in_group(self):
-        """Count how many active (unsealed) processes there are in the group."""
-        qbuild = self.get_query(process_projections=["id"], only_active=True)
-        return qbuild.count()
+        """Count how many active (unsealed) processes there are in the group (in the shard of this controller)."""
+        self._update_active_pks()
+        return len(self._get_shard_active_pks())
 
     @property
     def num_active_slots(self):
         """Number of active slots (i.e. processes in the group that are unsealed)."""
+        if self.num_shards > 1:
+            # The shard of the active processes is obtained from the index
+            self._check_submitted_extras()
         return self._count_active_in_group()
 
     @property
     def num_available_slots(self):
         """Number of available slots (i.e. how many processes would be submitted in the next batch submission)."""
-        return max(0, self.max_concurrent - self.num_active_slots)
+        return max(0, self.effective_max_concurrent - self.num_active_slots)
+
+    @property
+    def effective_max_concurrent(self):
+        """Maximum number of concurrent active processes currently allowed.
+
+        This is ``max_concurrent`` (or the share of this shard, see ``num_shards``), unless ``adaptive_concurrency`` is
+        enabled and congestion was measured.
+        """
+        max_concurrent = self.shard_max_concurrent
+        if not self.adaptive_concurrency or self._adaptive_limit is None:
+            return max_concurrent
+        return max(min(self.min_concurrent, max_concurrent), min(max_concurrent, int(self._adaptive_limit)))
+
+    def _get_shard_share(self, limit):
+        """Return the share of a limit of the shard of this controller, the shares of all shards adding up to it."""
+        return (limit * (self.shard_index + 1)) // self.num_shards - (limit * self.shard_index) // self.num_shards
+
+    @property
+    def shard_max_concurrent(self):
+        """Share of ``max_concurrent`` of the shard of this controller, the shares of all shards adding up to it."""
+        return self._get_shard_share(self.max_concurrent)
+
+    @property
+    def shard_max_concurrent_per_resource(self):
+        """Share of each of the limits in ``max_concurrent_per_resource`` of the shard of this controller."""
+        if not self.max_concurrent_per_resource:
+            return {}
+        return {key: self._get_shard_share(limit) for key, limit in self.max_concurrent_per_resource.items()}
+
+    def is_congested(self, since=None):
+        """Return whether the daemon is congested, i.e. whether submitting more processes would only queue them.
+
+        By default, the daemon is congested if an active process of the group is still in the ``created`` state (i.e.
+        it was not picked up by a daemon worker yet) more than ``max_queue_latency`` seconds after its creation. This
+        happens both when the workers have no free slots and when the broker queue is backed up. Override this method
+        to use other signals, e.g. the load of the machine running the daemon.
+
+        :param since: if specified, only processes created after this time are considered, so that the congestion
+            that caused the previous decrease of the limit is not counted twice.
+        """
+        active_pks = list(self._active_pks)
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.max_queue_latency)
+        ctime_filter = {"<": cutoff} if since is None else {"and": [{"<": cutoff}, {">": since}]}
+        for start in range(0, len(active_pks), QUERY_CHUNK_SIZE):
+            qbuild = self.get_query(
+                process_projections=["id"],
+                process_filters={
+                    "id": {"in": active_pks[start : start + QUERY_CHUNK_SIZE]},
+                    "attributes.process_state": "created",
+                    "ctime": ctime_filter,
+                },
+            )
+            if qbuild.limit(1).first() is not None:
+                return True
+        return False
+
+    def _update_adaptive_limit(self, num_active):
+        """Update the adaptive limit of concurrent active processes, with additive increase and multiplicative decrease.
+
+        :param num_active: the current number of active processes.
+        :return: the new value of ``effective_max_concurrent``.
+        """
+        if not self.adaptive_concurrency:
+            return self.effective_max_concurrent
+
+        if self._adaptive_limit is None:
+            self._adaptive_limit = float(self.shard_max_concurrent)
+
+        if self.is_congested():
+            # Only decrease once for the processes that were already congested at the previous decrease
+            if self._last_decrease is None or self.is_congested(since=self._last_decrease):
+                self._adaptive_limit = max(self.min_concurrent, self._adaptive_limit * self.adaptive_decrease_factor)
+                self._last_decrease = timezone.now()
+                CMDLINE_LOGGER.report(
+                    f"Congestion detected: reducing the concurrent processes to {self.effective_max_concurrent}."
+                )
+        elif num_active >= self.effective_max_concurrent:
+            self._adaptive_limit = min(self.shard_max_concurrent, self._adaptive_limit + self.adaptive_increase)
+
+        return self.effective_max_concurrent
 
     @property
     def num_to_run(self):
         """Number of processes that still have to be submitted."""
-        return len(set(self.get_all_extras_to_submit()).difference(self._check_submitted_extras()))
+        submitted_extras = self._check_submitted_extras()
+        return sum(
+            1
+            for extras_values in set(self.get_all_extras_to_submit())
+            if self._index_key(extras_values) not in submitted_extras and self._in_shard(extras_values)
+        )
 
     @property
     def num_already_run(self):
         """Number of processes that have already been submitted (and might or might not have finished)."""
         return len(self._check_submitted_extras())
 
-    def submit_new_batch(self, dry_run=False, sort=False, verbose=False, sleep=0):
-        """Submit a new batch of calculations, ensuring less than self.max_concurrent active at the same time."""
-        CMDLINE_LOGGER.level = logging.INFO if verbose else logging.WARNING
+    def get_status_snapshot(self, read_only=False):
+        """Return the current status of the controller as a ``StatusSnapshot``.
 
-        all_extras = set(self.get_all_extras_to_submit())
-        extras_to_run = list(all_extras.difference(self._check_submitted_extras()))
+        All quantities are computed from a single query of the extras to submit, of the submitted processes and of the
+        active ones, so they are consistent with each other.
 
-        if sort:
-            extras_to_run = sorted(extras_to_run)
+        :param read_only: if True, the state that drives the next batches is left untouched: the adaptive limit (see
+            ``adaptive_concurrency``) is not updated, and the failed processes are queried without updating their index.
+            Only the indexes mirroring the database (submitted and active processes) are brought up to date. Otherwise,
+            the journal is replayed first if this was not done yet (see ``journal_path``).
+        """
+        if not read_only and self.journal_path is not None and not self._journal_repaired:
+            self.repair_from_journal()
+
+        with self._time_metric("submitted_index"):
+            submitted_extras = self._check_submitted_extras()
+        with self._time_metric("failed_index"):
+            if not read_only:
+                failed = self._update_failed_index()
+            elif self.max_attempts > 1:
+                failed = self._query_failed(self.get_failed_filters())
+            else:
+                failed = {}
+        with self._time_metric("count_active"):
+            num_active_slots = self._count_active_in_group()
+        if read_only:
+            effective_max_concurrent = self.effective_max_concurrent
+        else:
+            with self._time_metric("adaptive_concurrency"):
+                effective_max_concurrent = self._update_adaptive_limit(num_active_slots)
 
-        number_to_submit = self.max_concurrent - self._count_active_in_group()
+        if self.streaming:
+            num_total = None
+            extras_to_run = self._iter_extras_to_run(submitted_extras)
+            num_to_run = None
+        else:
+            # Keep the order in which the extras are returned, e.g. the ``order_by`` of the parent group
+            with self._time_metric("extras_to_submit"):
+                all_extras = dict.fromkeys(self.get_all_extras_to_submit())
+            num_total = len(all_extras)
+            extras_to_run = [
+                extras_values
+                for extras_values in all_extras
+                if self._index_key(extras_values) not in submitted_extras and self._in_shard(extras_values)
+            ]
+            num_to_run = len(extras_to_run)
+        extras_to_retry = self._get_extras_to_retry(failed)
+
+        return StatusSnapshot(
+            num_total=num_total,
+            num_already_run=len(self._submitted_index),
+            num_to_run=num_to_run,
+            num_to_retry=len(extras_to_retry),
+            max_concurrent=self.max_concurrent,
+            effective_max_concurrent=effective_max_concurrent,
+            num_active_slots=num_active_slots,
+            num_available_slots=max(0, effective_max_concurrent - num_active_slots),
+            num_active_per_resource=self._count_active_per_resource(),
+            extras_to_run=extras_to_run,
+            extras_to_retry=extras_to_retry,
+        )
 
-        if dry_run:
-            return {key: None for key in extras_to_run[:number_to_submit]}
+    def _count_active_per_resource(self):
+        """Count the active processes for each of the resources in ``max_concurrent_per_resource``.
 
-        if verbose:
-            table = Table(title="Status")
+        The resource of each active process is obtained from its extras, as found in the index of submitted processes,
+        so this does not require any additional query. If ``identity_extra_key`` is set, the index only contains the
+        hashes of the extras, so the extras of the active processes are queried (only once for each process).
+        """
+        if not self.max_concurrent_per_resource:
+            return {}
+
+        extras_by_pk = self._submitted_pks
+        if self.identity_extra_key is not None:
+            self._active_extras = {pk: self._active_extras[pk] for pk in self._active_pks if pk in self._active_extras}
+            missing = [pk for pk in self._active_pks if pk not in self._active_extras]
+            for start in range(0, len(missing), QUERY_CHUNK_SIZE):
+                rows = self._get_submitted_extras_rows({"id": {"in": missing[start : start + QUERY_CHUNK_SIZE]}})
+                self._active_extras.update((data[-1], tuple(data[:-1])) for data in rows)
+            extras_by_pk = self._active_extras
+
+        counts = dict.fromkeys(self.max_concurrent_per_resource, 0)
+        for pk in self._get_shard_active_pks():
+            extras_values = extras_by_pk.get(pk)
+            if extras_values is None:
+                continue
+            resource_key = self.get_resource_key(extras_values)
+            if resource_key in counts:
+                counts[resource_key] += 1
 
-            table.add_column("Total", justify="left", style="cyan", no_wrap=True)
-            table.add_column("Submitted", justify="left", style="cyan", no_wrap=True)
-            table.add_column("Left to run", justify="left", style="cyan", no_wrap=True)
+        return counts
+
+    def _iter_within_resource_limits(self, extras_iterator, num_active_per_resource):
+        """Yield the candidates whose resource still has available slots, reserving a slot for each of them.
+
+        :param extras_iterator: an iterator over the extras values of the candidates.
+        :param num_active_per_resource: a dictionary with the number of active processes for each resource. It is
+            updated in place with the reserved slots.
+        """
+        max_concurrent_per_resource = self.shard_max_concurrent_per_resource
+        for extras_values in extras_iterator:
+            resource_key = self.get_resource_key(extras_values)
+            if resource_key in max_concurrent_per_resource:
+                if num_active_per_resource[resource_key] >= max_concurrent_per_resource[resource_key]:
+                    continue
+                num_active_per_resource[resource_key] += 1
+            yield extras_values
+
+    def order_by_priority(self, extras_values_list):
+        """Yield the extras in order of priority, as returned by ``get_priority()``, lowest value first.
+
+        Rather than sorting all of them, a heap is built in linear time and only the items that are actually needed
+        are popped from it. Items with the same priority are yielded in order of their extras values.
+        """
+        heap = [(self.get_priority(extras_values), extras_values) for extras_values in extras_values_list]
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[1]
+
+    def _iter_extras_to_run(self, submitted_extras):
+        """Yield the extras returned by ``get_all_extras_to_submit()`` that were not submitted yet, lazily."""
+        yielded = set()
+        for extras_values in self.get_all_extras_to_submit():
+            if (
+                extras_values in yielded
+                or self._index_key(extras_values) in submitted_extras
+                or not self._in_shard(extras_values)
+            ):
+                continue
+            yielded.add(extras_values)
+            yield extras_values
+
+    def has_extras_to_run(self):
+        """Return whether there is at least one process that still has to be submitted, or resubmitted."""
+        submitted_extras = self._check_submitted_extras()
+        if self._update_failed_index():
+            return True
+        return next(self._iter_extras_to_run(submitted_extras), None) is not None
+
+    def print_status(self, snapshot=None):
+        """Print a table with the status of the controller.
+
+        :param snapshot: the ``StatusSnapshot`` to print. If not specified, a new (read-only) one is computed.
+        """
+        snapshot = snapshot or self.get_status_snapshot(read_only=True)
+
+        table = Table(title="Status")
+
+        table.add_column("Total", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Submitted", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Left to run", justify="left", style="cyan", no_wrap=True)
+        if self.max_attempts > 1:
+            table.add_column("To retry", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Max active", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Active", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Available", justify="left", style="cyan", no_wrap=True)
+
+        row = [
+            "?" if snapshot.num_total is None else str(snapshot.num_total),
+            str(snapshot.num_already_run),
+            "?" if snapshot.num_to_run is None else str(snapshot.num_to_run),
+        ]
+        if self.max_attempts > 1:
+            row.append(str(snapshot.num_to_retry))
+        max_active = str(snapshot.max_concurrent)
+        if snapshot.effective_max_concurrent != snapshot.max_concurrent:
+            max_active = f"{snapshot.effective_max_concurrent}/{max_active}"
+        row += [max_active, str(snapshot.num_active_slots), str(snapshot.num_available_slots)]
+        table.add_row(*row)
+        console = Console()
+        console.print(table)
+
+        if snapshot.num_active_per_resource:
+            table = Table(title="Resources")
+
+            table.add_column("Resource", justify="left", style="cyan", no_wrap=True)
             table.add_column("Max active", justify="left", style="cyan", no_wrap=True)
             table.add_column("Active", justify="left", style="cyan", no_wrap=True)
-            table.add_column("Available", justify="left", style="cyan", no_wrap=True)
-
-            table.add_row(
-                str(len(all_extras)),
-                str(self.num_already_run),
-                str(self.num_to_run),
-                str(self.max_concurrent),
-                str(self.num_active_slots),
-                str(self.num_available_slots),
-            )
-            console = Console()
+
+            max_concurrent_per_resource = self.shard_max_concurrent_per_resource
+            for resource_key, num_active in snapshot.num_active_per_resource.items():
+                table.add_row(str(resource_key), str(max_concurrent_per_resource[resource_key]), str(num_active))
             console.print(table)
 
-            if number_to_submit <= 0 or self.num_to_run == 0:
-                print("[bold blue]Info:[/] 😴 Nothing to submit.")
+    def _get_rate_limiter(self, sleep=0):
+        """Return the ``TokenBucket`` limiting the submissions, or ``None`` if they are not limited.
+
+        The bucket defined by ``max_submission_rate`` is kept between batches. A ``sleep`` between submissions is
+        translated into a bucket with a rate of one submission every ``sleep`` seconds, for the current batch only.
+        """
+        if sleep:
+            return TokenBucket(rate=1 / sleep, burst=1)
+
+        if self.max_submission_rate is None:
+            self._rate_limiter = None
+        elif (
+            self._rate_limiter is None
+            or self._rate_limiter.rate != self.max_submission_rate
+            or self._rate_limiter.burst != self.submission_burst
+        ):
+            self._rate_limiter = TokenBucket(rate=self.max_submission_rate, burst=self.submission_burst)
+
+        return self._rate_limiter
+
+    def submit_new_batch(self, dry_run=False, sort=False, verbose=False, sleep=0, max_to_submit=None, snapshot=None):
+        """Submit a new batch of calculations, ensuring less than self.max_concurrent active at the same time.
+
+        :param sort: if True, submit the processes in order of priority, as returned by ``get_priority()``. Otherwise,
+            they are submitted in the order in which they are returned by ``get_all_extras_to_submit()``.
+        :param sleep: minimum number of seconds between two submissions. Rather than sleeping after each submission,
+            the next process is already prepared while waiting. See also ``max_submission_rate``.
+        :param max_to_submit: maximum number of processes to submit in this batch, on top of the available slots.
+        :param snapshot: the ``StatusSnapshot`` to submit the batch from, if it was just computed (e.g. by an
+            orchestrator, to know how many processes each controller can submit). It cannot be reused for another batch.
+        """
+        CMDLINE_LOGGER.level = logging.INFO if verbose else logging.WARNING
+
+        with self.collect_metrics():
+            return self._submit_new_batch(dry_run, sort, verbose, sleep, max_to_submit, snapshot)
+
+    async def submit_new_batch_async(
+        self, dry_run=False, sort=False, verbose=False, sleep=0, max_to_submit=None, max_in_flight=10
+    ):
+        """Submit a new batch of calculations as a coroutine, to embed the controller in an existing event loop.
+
+        See ``submit_new_batch()`` for the parameters. AiiDA storage sessions are bound to a thread, so the queries,
+        the construction of the inputs, the submissions and the bookkeeping still run in the thread of the event loop,
+        but one short step at a time, letting other tasks run in between. ``prepare_inputs()`` (which must not access
+        the database) runs in the default executor of the event loop, for up to ``max_in_flight`` processes at a time,
+        overlapping with the submissions; waiting for ``max_submission_rate`` does not block the event loop either.
+        The processes are therefore not necessarily submitted in the order of the candidates.
+
+        :param max_in_flight: maximum number of processes being prepared or submitted at the same time.
+        """
+        CMDLINE_LOGGER.level = logging.INFO if verbose else logging.WARNING
+
+        with self.collect_metrics():
+            return await self._submit_new_batch_async(dry_run, sort, verbose, sleep, max_to_submit, max_in_flight)
+
+    async def _submit_new_batch_async(self, dry_run, sort, verbose, sleep, max_to_submit, max_in_flight):
+        """Submit a new batch of calculations as a coroutine: see ``submit_new_batch_async()``."""
+        if max_in_flight < 1:
+            raise ValueError(f"`max_in_flight` must be at least 1, got {max_in_flight}.")
+
+        loop = asyncio.get_running_loop()
+        snapshot, number_to_submit, next_extras, extras_to_run = self._select_batch(sort, max_to_submit, dry_run)
+
+        if dry_run:
+            return {key: None for key in next_extras}
+
+        await asyncio.sleep(0)
+        self._start_batch(snapshot, next_extras, verbose)
+
+        submitted = {}
+        pending = []
+        rate_limiter = self._get_rate_limiter(sleep)
+        candidates = itertools.chain(next_extras, extras_to_run)
+
+        async def prepare_and_submit(workchain_extras):
+            try:
+                prepared = await loop.run_in_executor(None, self._prepare_inputs_cached, workchain_extras)
+            except Exception as exc:
+                prepared, exception = None, exc
             else:
-                print(f"[bold blue]Info:[/] 🚀 Submitting {min(number_to_submit, self.num_to_run)} new workchains!")
+                exception = None
+
+            while rate_limiter is not None and not rate_limiter.try_acquire():
+                with self._time_metric("rate_limit_wait"):
+                    await asyncio.sleep(rate_limiter.time_until_available())
+
+            self._submit_prepared(workchain_extras, prepared, exception, submitted, pending)
+
+        # Tasks are cancelled before they submit, so the extras of cancelled tasks are kept for the next batch
+        in_flight = {}
+        try:
+            while True:
+                while len(in_flight) < min(max_in_flight, number_to_submit - len(submitted)):
+                    workchain_extras = next(candidates, None)
+                    if workchain_extras is None:
+                        break
+                    in_flight[asyncio.ensure_future(prepare_and_submit(workchain_extras))] = workchain_extras
+
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del in_flight[task]
+                for task in done:
+                    task.result()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            self._commit_submitted(pending)
+            unused = [workchain_extras for task, workchain_extras in in_flight.items() if task.cancelled()]
+            self._leftover_candidates = (sort, itertools.chain(unused, candidates))
+
+        return submitted
+
+    @contextlib.contextmanager
+    def collect_metrics(self):
+        """Context manager collecting the metrics of a batch submission and passing them to ``metrics_sink``.
+
+        Batch submissions collect their own metrics. Entering it before (e.g. from an orchestrator) also collects the
+        timings of what is done in between, such as computing the ``StatusSnapshot`` of the batch: the metrics of the
+        nested batch submission are then collected in the same ``CycleMetrics``.
+
+        :return: the ``CycleMetrics`` being collected, or ``None`` if ``metrics_sink`` is not set.
+        """
+        if self.metrics_sink is None or self._metrics is not None:
+            yield self._metrics
+            return
+
+        self._metrics = CycleMetrics(labels={"controller": type(self).__name__, "group": self.group_label})
+        try:
+            yield self._metrics
+        finally:
+            metrics, self._metrics = self._metrics, None
+            self.metrics_sink(metrics.as_dict())
+
+    def _time_metric(self, phase):
+        """Return a context manager timing the given phase, if metrics are being collected for the current batch."""
+        if self._metrics is None:
+            return contextlib.nullcontext()
+        return self._metrics.timer(phase)
+
+    def _count_metric(self, counter, value=1):
+        """Increment the given counter, if metrics are being collected for the current batch."""
+        if self._metrics is not None:
+            self._metrics.increment(counter, value)
+
+    def _submit_new_batch(self, dry_run, sort, verbose, sleep, max_to_submit, snapshot=None):
+        """Submit a new batch of calculations: see ``submit_new_batch()``."""
+        snapshot, number_to_submit, next_extras, extras_to_run = self._select_batch(
+            sort, max_to_submit, dry_run, snapshot
+        )
+
+        if dry_run:
+            return {key: None for key in next_extras}
+
+        self._start_batch(snapshot, next_extras, verbose)
 
         submitted = {}
+        pending = []
+        rate_limiter = self._get_rate_limiter(sleep)
+        candidates = itertools.chain(next_extras, extras_to_run)
+        unused = []
+
+        try:
+            for workchain_extras, prepared, exception in self._iter_prepared_inputs(
+                candidates, lambda: number_to_submit - len(submitted), unused
+            ):
+                self._submit_prepared(workchain_extras, prepared, exception, submitted, pending, rate_limiter)
+        finally:
+            self._commit_submitted(pending)
+            self._leftover_candidates = (sort, itertools.chain(unused, candidates))
 
-        for workchain_extras in extras_to_run:
-            if len(submitted) >= number_to_submit:
-                break
+        return submitted
 
-            try:
-                # Get the inputs and the process calculation for submission
+    def _select_batch(self, sort, max_to_submit, dry_run=False, snapshot=None):
+        """Select the processes to submit in the next batch.
+
+        :param dry_run: if True, the state of the controller is not changed (see ``get_status_snapshot()``).
+        :param snapshot: the ``StatusSnapshot`` to select the processes from. By default, a new one is computed.
+        :return: a tuple ``(snapshot, number_to_submit, next_extras, extras_to_run)`` with the ``StatusSnapshot``, the
+            number of processes to submit, the list of the extras of the first candidates, and an iterator over the
+            remaining ones (that are submitted instead of the first ones that fail).
+        """
+        self._leftover_candidates = None
+        if snapshot is None:
+            snapshot = self.get_status_snapshot(read_only=dry_run)
+        extras_to_run = snapshot.extras_to_run
+        extras_to_retry = snapshot.extras_to_retry
+
+        if sort:
+            if self.streaming:
+                raise ValueError("Sorting the extras to submit is not supported in streaming mode.")
+            extras_to_run = self.order_by_priority(extras_to_run)
+            extras_to_retry = self.order_by_priority(extras_to_retry)
+
+        if self.retry_policy == "first":
+            extras_to_run = itertools.chain(extras_to_retry, extras_to_run)
+        else:
+            extras_to_run = itertools.chain(extras_to_run, extras_to_retry)
+
+        number_to_submit = snapshot.num_available_slots
+        if max_to_submit is not None:
+            number_to_submit = min(number_to_submit, max(0, max_to_submit))
+
+        # Only the first candidates are requested, so in streaming mode the rest is never produced if not needed
+        extras_to_run = iter(extras_to_run)
+        if self.max_concurrent_per_resource:
+            extras_to_run = self._iter_within_resource_limits(extras_to_run, dict(snapshot.num_active_per_resource))
+        next_extras = list(itertools.islice(extras_to_run, number_to_submit))
+
+        return snapshot, number_to_submit, next_extras, extras_to_run
+
+    def _start_batch(self, snapshot, next_extras, verbose):
+        """Report the status (if ``verbose``) and prefetch what is needed to submit the selected processes."""
+        if verbose:
+            self.print_status(snapshot)
+
+            if not next_extras:
+                print("[bold blue]Info:[/] 😴 Nothing to submit.")
+            else:
+                print(f"[bold blue]Info:[/] 🚀 Submitting {len(next_extras)} new workchains!")
+
+        if next_extras:
+            with self._time_metric("prefetch"):
+                self.prefetch(next_extras)
+
+    def _submit_prepared(self, workchain_extras, prepared, exception, submitted, pending, rate_limiter=None):
+        """Build the inputs and submit the process for the given extras, once ``prepare_inputs()`` was called.
+
+        Failures are logged rather than raised, so that the next candidate can be submitted instead.
+
+        :param prepared: the value returned by ``prepare_inputs()``.
+        :param exception: the exception raised by ``prepare_inputs()``, if any.
+        :param submitted: the dictionary of processes submitted in this batch, updated in place.
+        :param pending: the list of processes whose bookkeeping is still to be committed, updated in place.
+        :param rate_limiter: an optional ``TokenBucket`` limiting the rate of submissions.
+        """
+        try:
+            if exception is not None:
+                raise exception
+            self._prepared_inputs[workchain_extras] = prepared
+
+            # Get the inputs and the process calculation for submission
+            with self._time_metric("build_inputs"):
                 builder = self.get_inputs_and_processclass_from_extras(workchain_extras)
 
-                # Actually submit
-                wc_node = engine.submit(builder)
+            if rate_limiter is not None and not rate_limiter.try_acquire():
+                # Use the waiting time to commit the bookkeeping of the processes submitted so far
+                self._commit_submitted(pending)
+                with self._time_metric("rate_limit_wait"):
+                    rate_limiter.acquire()
+
+            # Claim right before submitting, so that the claim is held for as short a time as possible
+            if self.claim_submissions:
+                with self._time_metric("claim"):
+                    claimed = self._claim(workchain_extras)
+                if not claimed:
+                    self._count_metric("claimed_elsewhere")
+                    return
+
+            # Actually submit
+            try:
+                with self._time_metric("submit"):
+                    wc_node = engine.submit(builder)
+            except Exception:
+                if workchain_extras in self._claims:
+                    self._release_claim(self._claims.pop(workchain_extras))
+                raise
+
+        except Exception as exc:
+            CMDLINE_LOGGER.error(f"Failed to submit work chain for extras <{workchain_extras}>: {exc}")
+            self._count_metric("failed")
+        else:
+            CMDLINE_LOGGER.report(f"Submitted work chain <{wc_node}> for extras <{workchain_extras}>.")
+            self._count_metric("submitted")
+            if self.journal_path is not None:
+                attempt = self._failed[workchain_extras][1] + 1 if workchain_extras in self._failed else None
+                self._get_journal().record_submitted(workchain_extras, wc_node.pk, attempt)
+            if workchain_extras in self._failed:
+                self._count_metric("resubmitted")
+
+            pending.append((workchain_extras, wc_node))
+            submitted[workchain_extras] = wc_node
+
+            if self.prepared_inputs_cache_size:
+                self._get_prepared_inputs_cache().discard(workchain_extras)
+
+            if len(pending) >= self.bookkeeping_chunk_size:
+                self._commit_submitted(pending)
+        finally:
+            self._prepared_inputs.pop(workchain_extras, None)
+
+    def _get_prepared_inputs_cache(self):
+        """Return the ``PreparedInputsCache`` of the controller, creating it if needed."""
+        cache = self._prepared_inputs_cache
+        if cache is None or (cache.max_size, cache.ttl, cache.directory) != (
+            self.prepared_inputs_cache_size,
+            self.prepared_inputs_cache_ttl,
+            self.prepared_inputs_cache_dir,
+        ):
+            cache = PreparedInputsCache(
+                max_size=self.prepared_inputs_cache_size,
+                ttl=self.prepared_inputs_cache_ttl,
+                directory=self.prepared_inputs_cache_dir,
+            )
+            self._prepared_inputs_cache = cache
+        return cache
+
+    def _prepare_inputs_cached(self, extras_values):
+        """Return the value of ``prepare_inputs()``, from the cache if ``prepared_inputs_cache_size`` is set."""
+        if not self.prepared_inputs_cache_size:
+            with self._time_metric("prepare_inputs"):
+                return self.prepare_inputs(extras_values)
+
+        cache = self._get_prepared_inputs_cache()
+        prepared = cache.get(extras_values, PreparedInputsCache.MISSING)
+        if prepared is PreparedInputsCache.MISSING:
+            with self._time_metric("prepare_inputs"):
+                prepared = self.prepare_inputs(extras_values)
+            cache.set(extras_values, prepared)
+        else:
+            self._count_metric("prepared_inputs_cache_hits")
+        return prepared
 
-            except Exception as exc:
-                CMDLINE_LOGGER.error(f"Failed to submit work chain for extras <{workchain_extras}>: {exc}")
+    def prepare_ahead(self, number, sort=False):
+        """Call ``prepare_inputs()`` for the next processes to submit, and cache the result.
+
+        This is meant to be called while waiting for slots to become available, so that the next batch can be submitted
+        faster. It requires ``prepared_inputs_cache_size`` to be set, and uses ``preparation_workers`` threads if set.
+
+        The candidates are the ones that the previous batch did not need, in the same order, so that they are not
+        queried again; they include the failed processes to resubmit and respect ``max_concurrent_per_resource``. If no
+        batch was submitted since the previous call (or with a different ``sort``), they are selected as the next batch
+        would, without changing the state of the controller.
+
+        :param number: number of processes to prepare, after the ones that are already in the cache.
+        :param sort: if True, prepare the processes in order of priority, as done by ``submit_new_batch()``.
+        """
+        if not self.prepared_inputs_cache_size:
+            raise ValueError("Preparing inputs ahead requires `prepared_inputs_cache_size` to be set.")
+
+        cache = self._get_prepared_inputs_cache()
+        if self._leftover_candidates is None or self._leftover_candidates[0] != sort:
+            _, _, next_extras, extras_to_run = self._select_batch(sort, None, dry_run=True)
+            self._leftover_candidates = (sort, itertools.chain(next_extras, extras_to_run))
+        extras_to_run = self._leftover_candidates[1]
+        candidates = (extras_values for extras_values in extras_to_run if extras_values not in cache)
+        number = min(number, self.prepared_inputs_cache_size)
+        for extras_values, _, exception in self._iter_prepared_inputs(
+            itertools.islice(candidates, number), lambda: number
+        ):
+            if exception is not None:
+                CMDLINE_LOGGER.warning(f"Failed to prepare the inputs for extras <{extras_values}>: {exception}")
+
+    def _iter_prepared_inputs(self, extras_iterator, num_needed, unused=None):
+        """Yield ``(extras_values, prepared, exception)`` for the candidates, in order, calling ``prepare_inputs()``.
+
+        With ``preparation_workers``, up to that many candidates are prepared concurrently, ahead of the one that is
+        being submitted, but never more than the number of processes that still have to be submitted.
+
+        :param extras_iterator: an iterator over the extras values of the candidates.
+        :param num_needed: a callable returning the number of processes that still have to be submitted.
+        :param unused: an optional list, extended with the candidates that were taken from ``extras_iterator`` but not
+            yielded (e.g. because of an exception), so that they can still be used.
+        """
+        if not self.preparation_workers:
+            while num_needed() > 0:
+                extras_values = next(extras_iterator, None)
+                if extras_values is None:
+                    return
+                try:
+                    prepared = self._prepare_inputs_cached(extras_values)
+                except Exception as exc:
+                    yield extras_values, None, exc
+                else:
+                    yield extras_values, prepared, None
+            return
+
+        with ThreadPoolExecutor(max_workers=self.preparation_workers) as executor:
+            in_flight = collections.deque()
+            try:
+                while True:
+                    while len(in_flight) < min(self.preparation_workers, num_needed()):
+                        extras_values = next(extras_iterator, None)
+                        if extras_values is None:
+                            break
+                        in_flight.append((extras_values, executor.submit(self._prepare_inputs_cached, extras_values)))
+
+                    if not in_flight:
+                        return
+
+                    extras_values, future = in_flight.popleft()
+                    try:
+                        prepared = future.result()
+                    except Exception as exc:
+                        yield extras_values, None, exc
+                    else:
+                        yield extras_values, prepared, None
+            finally:
+                for extras_values, future in in_flight:
+                    future.cancel()
+                    if unused is not None:
+                        unused.append(extras_values)
+
+    def _commit_submitted(self, pending, attempts=None):
+        """Set the unique extras on the submitted processes and add them to the group, in a single transaction.
+
+        :param pending: a list of ``(extras_values, process_node)`` tuples, that is emptied once committed.
+        :param attempts: an optional dictionary with the number of the attempt of resubmitted processes, by extras. By
+            default, it is deduced from the failed processes that are being resubmitted.
+        """
+        if not pending:
+            return
+
+        extra_keys = self.get_extra_unique_keys()
+        group = self.group
+        attempts = attempts or {}
+
+        with self._time_metric("commit"), group.backend.transaction():
+            for workchain_extras, wc_node in pending:
+                extras = get_extras_dict(extra_keys, workchain_extras)
+                if workchain_extras in attempts:
+                    extras[self.attempt_extra_key] = attempts[workchain_extras]
+                elif workchain_extras in self._failed:
+                    extras[self.attempt_extra_key] = self._failed[workchain_extras][1] + 1
+                if self.identity_extra_key is not None:
+                    extras[self.identity_extra_key] = self.get_identity(workchain_extras)
+                wc_node.base.extras.set_many(extras)
+            group.add_nodes([wc_node for _, wc_node in pending])
+
+        if self.journal_path is not None:
+            self._get_journal().record_committed([wc_node.pk for _, wc_node in pending])
+
+        for workchain_extras, wc_node in pending:
+            key = self._index_key(workchain_extras)
+            self._submitted_index[key] = wc_node.pk
+            self._submitted_pks[wc_node.pk] = key
+            if self.identity_extra_key is not None:
+                self._active_extras[wc_node.pk] = workchain_extras
+            self._failed.pop(workchain_extras, None)
+            if workchain_extras in self._claims:
+                self._release_claim(self._claims.pop(workchain_extras))
+        pending.clear()
+
+    def _get_journal(self):
+        """Return the ``SubmissionJournal`` of the controller, creating it if needed."""
+        if self._journal is None or self._journal.path != self.journal_path:
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = SubmissionJournal(self.journal_path)
+            self._journal_repaired = False
+        return self._journal
+
+    def repair_from_journal(self):
+        """Commit the bookkeeping of the processes that were submitted but not committed, according to the journal.
+
+        Their extras are set and they are added to the group in a single transaction; processes that are already in
+        the group, or that were deleted, are skipped. The journal is then compacted. This is called automatically
+        before the first batch submission when ``journal_path`` is set (but not for a dry run).
+
+        :return: the number of processes that were repaired.
+        """
+        if self.journal_path is None:
+            raise ValueError("Repairing from the journal requires `journal_path` to be set.")
+
+        journal = self._get_journal()
+        uncommitted = journal.get_uncommitted()
+        pks = list(uncommitted)
+
+        in_group = set()
+        nodes = {}
+        for start in range(0, len(pks), QUERY_CHUNK_SIZE):
+            chunk = pks[start : start + QUERY_CHUNK_SIZE]
+            in_group.update(
+                self.get_query(process_projections=["id"], process_filters={"id": {"in": chunk}}).all(flat=True)
+            )
+            qbuild = orm.QueryBuilder().append(orm.ProcessNode, filters={"id": {"in": chunk}}, project=["id", "*"])
+            nodes.update(qbuild.all())
+
+        pending = []
+        attempts = {}
+        for pk, (extras_values, attempt) in uncommitted.items():
+            if pk in in_group or pk not in nodes:
+                continue
+            pending.append((extras_values, nodes[pk]))
+            if attempt is not None:
+                attempts[extras_values] = attempt
+
+        if pending:
+            CMDLINE_LOGGER.report(f"Repairing the bookkeeping of {len(pending)} submitted processes from the journal.")
+            self._commit_submitted(pending, attempts)
+
+        journal.record_committed(pks)
+        journal.compact()
+        self._journal_repaired = True
+        return len(pending)
+
+    def run_forever(
+        self,
+        poll_interval=60.0,
+        max_poll_interval=600.0,
+        backoff_factor=2.0,
+        stop_when_done=True,
+        prepare_ahead=0,
+        events=None,
+        event_debounce=1.0,
+        **kwargs,
+    ):
+        """Keep submitting new batches in the current interpreter, until stopped.
+
+        This replaces calling the script in a shell loop: the controller (and its index of submitted processes) stays
+        in memory between cycles, so every cycle only has to query what changed. When a cycle does not submit anything,
+        the waiting time is multiplied by ``backoff_factor``, up to ``max_poll_interval``; it is reset to
+        ``poll_interval`` as soon as new processes are submitted.
+
+        The loop stops cleanly (i.e. never in the middle of a batch) on ``SIGINT`` or ``SIGTERM``, or when ``stop()``
+        is called from another thread.
+
+        :param poll_interval: seconds to wait between two cycles.
+        :param max_poll_interval: maximum seconds to wait between two cycles when backing off.
+        :param backoff_factor: factor by which the waiting time is increased after a cycle without submissions.
+        :param stop_when_done: if True, return once all processes were submitted and none of them is active anymore.
+        :param prepare_ahead: number of processes to prepare after each batch, while waiting for the next one. See
+            ``prepare_ahead()``.
+        :param events: an optional ``ProcessTerminationEvents`` (e.g. a ``BroadcastTerminationEvents``), to submit a
+            new batch as soon as a process of the group terminates. The polling interval then only serves to reconcile
+            events that were missed, so it can be much longer.
+        :param event_debounce: seconds to wait after a termination event before submitting, to group the events
+            arriving together.
+        :param kwargs: passed on to ``submit_new_batch()``.
+        """
+
+        def submit_batch():
+            submitted = self.submit_new_batch(**kwargs)
+            if prepare_ahead:
+                self.prepare_ahead(prepare_ahead, sort=kwargs.get("sort", False))
+            return submitted
+
+        def is_done():
+            return stop_when_done and self.num_active_slots == 0 and not self.has_extras_to_run()
+
+        run_polling_loop(
+            submit_batch,
+            is_done,
+            self._stop_event,
+            poll_interval=poll_interval,
+            max_poll_interval=max_poll_interval,
+            backoff_factor=backoff_factor,
+            events=events,
+            is_relevant=self.has_submitted,
+            event_debounce=event_debounce,
+        )
+
+    async def run_forever_async(
+        self, poll_interval=60.0, max_poll_interval=600.0, backoff_factor=2.0, stop_when_done=True, **kwargs
+    ):
+        """Keep submitting new batches with ``submit_new_batch_async()``, until stopped.
+
+        This is the asynchronous counterpart of ``run_forever()``, to run the controller as a task of an existing event
+        loop. It stops when ``stop()`` is called or when the task is cancelled; signals are left to the application
+        running the event loop.
+
+        :param kwargs: passed on to ``submit_new_batch_async()``.
+        """
+        self._stop_event.clear()
+
+        def is_done():
+            return stop_when_done and self.num_active_slots == 0 and not self.has_extras_to_run()
+
+        interval = poll_interval
+        while not self._stop_event.is_set():
+            submitted = await self.submit_new_batch_async(**kwargs)
+
+            if submitted:
+                interval = poll_interval
             else:
-                CMDLINE_LOGGER.report(f"Submitted work chain <{wc_node}> for extras <{workchain_extras}>.")
+                if is_done():
+                    CMDLINE_LOGGER.report("All processes have been submitted and completed: stopping.")
+                    break
+                interval = min(interval * backoff_factor, max(max_poll_interval, poll_interval))
 
-                wc_node.base.extras.set_many(get_extras_dict(self.get_extra_unique_keys(), workchain_extras))
-                self.group.add_nodes([wc_node])
-                submitted[workchain_extras] = wc_node
-                # Only add a delay if the submission was successful
-                time.sleep(sleep)
+            deadline = time.monotonic() + interval
+            while not self._stop_event.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(min(1.0, deadline - time.monotonic()))
 
-        return submitted
+    def stop(self):
+        """Request ``run_forever()`` or ``run_forever_async()`` to return after the current cycle."""
+        self._stop_event.set()
 
     def get_extra_unique_keys(self):
         """Return a tuple of the keys of the unique extras that will be used to uniquely identify your workchains."""
         return self.unique_extra_keys
 
+    def get_priority(self, extras_values):
+        """Return the priority of the process associated to a given tuple of extras values, when submitting with sort.
+
+        Processes with a lower value are submitted first. The values must be comparable with each other, and should not
+        change between batches, so that the order is stable. By default, the extras values themselves are returned,
+        i.e. processes are submitted in order of their extras.
+
+        :param extras_values: a tuple of values of the extras, in same order as the keys returned by
+            get_extra_unique_keys().
+        """
+        return extras_values
+
+    def get_resource_key(self, extras_values):
+        """Return the key of the resource used by the process associated to a given tuple of extras values.
+
+        It is used to apply the limits in ``max_concurrent_per_resource``, e.g. by returning the label of the computer
+        the process will run on. It should be cheap to compute, since it is called for the active processes and the
+        candidates of every batch. By default, it returns ``None``.
+
+        :param extras_values: a tuple of values of the extras, in same order as the keys returned by
+            get_extra_unique_keys().
+        """
+        return None
+
+    def estimate_runtime(self, extras_values):
+        """Return the estimated runtime, in seconds, of the process associated to a given tuple of extras values.
+
+        It is only used to plan a campaign, see ``aiida_submission_controller.planner``. By default, it returns
+        ``None``, meaning that the runtime is estimated from the processes of the group that already finished.
+
+        :param extras_values: a tuple of values of the extras, in same order as the keys returned by
+            get_extra_unique_keys().
+        """
+        return None
+
+    def prefetch(self, extras_values_list):
+        """Load in bulk what is needed to build the inputs of the processes that are about to be submitted.
+
+        This is called once per batch, before ``get_inputs_and_processclass_from_extras()`` is called for each of the
+        items. It does nothing by default, but can be overridden to replace one query per submission with a few queries
+        per batch.
+
+        :param extras_values_list: a list of tuples of values of the extras, in same order as the keys returned by
+            get_extra_unique_keys().
+        """
+
+    def prepare_inputs(self, extras_values):
+        """Prepare the data needed to build the inputs of the process associated to a given tuple of extras values.
+
+        This is meant for the expensive steps that do not need the database, e.g. generating or parsing files,
+        computing k-point meshes or loading protocols. With ``preparation_workers``, it is called concurrently from
+        several threads: since AiiDA nodes cannot be shared between threads, it should not load or create any node.
+        The returned value can be retrieved with ``get_prepared_inputs()`` when building the inputs.
+
+        By default, it does nothing and returns ``None``.
+
+        :param extras_values: a tuple of values of the extras, in same order as the keys returned by
+            get_extra_unique_keys().
+        """
+        return None
+
+    def get_prepared_inputs(self, extras_values):
+        """Return the value returned by ``prepare_inputs()`` for the process that is being submitted."""
+        return self._prepared_inputs.get(tuple(extras_values))
+
     @abc.abstractmethod
     def get_all_extras_to_submit(self):
         """Return a *set* of the values of all extras uniquely identifying all simulations that you want to submit.
@@ -257,6 +1883,8 @@ class BaseSubmissionController(BaseModel):
 
         :note: for each item, pass extra values as tuples (because lists are not hashable, so you cannot make
             a set out of them).
+        :note: in streaming mode (see ``streaming``), this can also return any iterable, e.g. a generator: it is then
+            only consumed up to the number of processes that can be submitted.
         """
         return
 
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Cache of the inputs prepared for the processes to submit."""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+
+class PreparedInputsCache:
+    """Cache of values keyed on tuples of extras values, with a maximum size and an optional time to live.
+
+    The values are kept in memory, or pickled in a directory if one is given, so that they survive a restart of the
+    controller. When the cache is full, the least recently used values are evicted first. It can be used from several
+    threads at the same time.
+    """
+
+    MISSING = object()
+    """Sentinel to pass as the default of ``get()``, to tell a missing key from a cached ``None`` value."""
+
+    def __init__(self, max_size, ttl=None, directory=None):
+        """Construct a new cache.
+
+        :param max_size: maximum number of values in the cache.
+        :param ttl: number of seconds after which a value expires, or ``None`` if values never expire.
+        :param directory: directory where to store the values. If ``None``, they are kept in memory.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _get_path(self, key):
+        """Return the path of the file storing the value for the given key."""
+        return os.path.join(self.directory, f"{hashlib.sha256(repr(key).encode()).hexdigest()}.pickle")
+
+    def get(self, key, default=None):
+        """Return the value for the given key, or ``default`` if it is not in the cache or has expired."""
+        with self._lock:
+            if self.directory is None:
+                if key not in self._memory:
+                    return default
+                timestamp, value = self._memory[key]
+                if self.ttl is not None and time.time() - timestamp > self.ttl:
+                    del self._memory[key]
+                    return default
+                self._memory.move_to_end(key)
+                return value
+
+            path = self._get_path(key)
+            try:
+                with open(path, "rb") as handle:
+                    timestamp, stored_key, value = pickle.load(handle)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return default
+            if stored_key != key:
+                return default
+            if self.ttl is not None and time.time() - timestamp > self.ttl:
+                os.remove(path)
+                return default
+            # The modification time is used to evict the least recently used values first
+            os.utime(path)
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, self.MISSING) is not self.MISSING
+
+    def set(self, key, value):
+        """Store the value for the given key, evicting the least recently used values if the cache is full."""
+        with self._lock:
+            if self.directory is None:
+                self._memory[key] = (time.time(), value)
+                self._memory.move_to_end(key)
+                while len(self._memory) > self.max_size:
+                    self._memory.popitem(last=False)
+                return
+
+            with tempfile.NamedTemporaryFile("wb", dir=self.directory, suffix=".tmp", delete=False) as handle:
+                pickle.dump((time.time(), key, value), handle)
+            os.replace(handle.name, self._get_path(key))
+
+            paths = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pickle")]
+            if len(paths) > self.max_size:
+                paths.sort(key=lambda entry: entry.stat().st_mtime)
+                for entry in paths[: len(paths) - self.max_size]:
+                    os.remove(entry.path)
+
+    def discard(self, key):
+        """Remove the value for the given key from the cache, if present."""
+        with self._lock:
+            if self.directory is None:
+                self._memory.pop(key, None)
+                return
+            try:
+                os.remove(self._get_path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Sources of process termination events, to refill the freed slots without waiting for the next poll."""
+import threading
+
+import kiwipy
+
+TERMINAL_STATES = ("finished", "excepted", "killed")
+"""Process states after which the slot of a process is freed."""
+
+
+class ProcessTerminationEvents:
+    """Collector of the PKs of terminated processes, that a controller waits on between two batches.
+
+    This base class does not listen to anything by itself: events are added with ``notify()``, e.g. from tests or from
+    another part of the application that knows when processes terminate. See ``BroadcastTerminationEvents`` to receive
+    them from the AiiDA engine. An instance should only be used by one controller (or orchestrator) at a time.
+    """
+
+    def __init__(self):
+        """Construct a new collector, without any event."""
+        self._condition = threading.Condition()
+        self._pks = set()
+
+    def notify(self, pk):
+        """Record that the process with the given PK terminated, waking up the waiting controller."""
+        with self._condition:
+            self._pks.add(pk)
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait until at least one process terminated, or until ``timeout`` seconds have elapsed.
+
+        :return: the set of the PKs of the processes that terminated since the previous call, possibly empty.
+        """
+        with self._condition:
+            if not self._pks:
+                self._condition.wait(timeout)
+            pks, self._pks = self._pks, set()
+        return pks
+
+    def close(self):
+        """Stop listening to events."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BroadcastTerminationEvents(ProcessTerminationEvents):
+    """Collector of the termination events broadcast by the AiiDA engine through the message broker.
+
+    Processes broadcast a ``state_changed.<from>.<to>`` message, with their PK as sender, at each change of state: the
+    ones to a terminal state are collected. This requires a profile with a broker.
+    """
+
+    def __init__(self, communicator=None):
+        """Construct a new collector, subscribing to the broadcasts.
+
+        :param communicator: the communicator to subscribe with. By default, the one of the current profile.
+        """
+        super().__init__()
+        if communicator is None:
+            from aiida.manage import get_manager  # pylint: disable=import-outside-toplevel
+
+            communicator = get_manager().get_communicator()
+
+        broadcast_filter = kiwipy.BroadcastFilter(self._on_broadcast)
+        for state in TERMINAL_STATES:
+            broadcast_filter.add_subject_filter(f"state_changed.*.{state}")
+
+        self._communicator = communicator
+        self._identifier = communicator.add_broadcast_subscriber(broadcast_filter)
+
+    def _on_broadcast(self, _communicator, _body, sender, _subject, _correlation_id):
+        """Record the termination of the process that sent the broadcast."""
+        if sender is not None:
+            self.notify(int(sender))
+
+    def close(self):
+        """Unsubscribe from the broadcasts."""
+        if self._identifier is not None:
+            self._communicator.remove_broadcast_subscriber(self._identifier)
+            self._identifier = None
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 """A prototype class to submit processes in batches, avoiding to submit too many."""
+import operator
 from typing import Optional
 
 from aiida import orm
-from pydantic import field_validator
+from pydantic import PrivateAttr, field_validator
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import aliased
 
-from .base import BaseSubmissionController, validate_group_exists
+from .base import QUERY_CHUNK_SIZE, BaseSubmissionController, validate_group_exists
 
 
 class FromGroupSubmissionController(BaseSubmissionController):  # pylint: disable=abstract-method
@@ -26,15 +29,68 @@ class FromGroupSubmissionController(BaseSubmissionController):  # pylint: disabl
 
     _validate_group_exists = field_validator("parent_group_label")(validate_group_exists)
 
+    _parent_group: Optional[tuple] = PrivateAttr(default=None)
+    _parent_nodes: dict = PrivateAttr(default_factory=dict)
+    _parent_cursor: tuple = PrivateAttr(default=(None, None))
+
     @property
     def parent_group(self):
         """Return the AiiDA ORM Group instance of the parent group."""
-        return orm.Group.collection.get(label=self.parent_group_label)
+        if self._parent_group is None or self._parent_group[0] != self.parent_group_label:
+            self._parent_group = (self.parent_group_label, orm.Group.collection.get(label=self.parent_group_label))
+        return self._parent_group[1]
+
+    def get_parent_nodes_from_extras(self, extras_values_list):
+        """Return the Node instances (in the parent group) from a list of (unique) extras identifying them.
+
+        The nodes are loaded with one query per ``QUERY_CHUNK_SIZE`` items, rather than one query per item.
+
+        :return: a dictionary where the keys are the tuples of extras values and the values the corresponding nodes.
+            Extras for which no node is found in the parent group are not included.
+        """
+        extras_projections = self.get_process_extra_projections()
+        extras_values_list = list(dict.fromkeys(tuple(extras_values) for extras_values in extras_values_list))
+        for extras_values in extras_values_list:
+            assert len(extras_values) == len(
+                extras_projections
+            ), f"The extras must be of length {len(extras_projections)}"
+
+        parent_nodes = {}
+        for start in range(0, len(extras_values_list), QUERY_CHUNK_SIZE):
+            chunk = extras_values_list[start : start + QUERY_CHUNK_SIZE]
+            if len(extras_projections) == 1:
+                filters = {extras_projections[0]: {"in": [extras_values[0] for extras_values in chunk]}}
+            else:
+                filters = {"or": [dict(zip(extras_projections, extras_values)) for extras_values in chunk]}
+
+            qbuild = orm.QueryBuilder()
+            qbuild.append(orm.Group, filters={"id": self.parent_group.pk}, tag="group")
+            qbuild.append(
+                orm.Node, project=extras_projections + ["*"], filters=filters, tag="process", with_group="group"
+            )
+            for data in qbuild.all():
+                extras_values = tuple(data[:-1])
+                if extras_values in parent_nodes:
+                    raise ValueError(f"I would have expected only 1 result for extras={extras_values}, I found >1")
+                parent_nodes[extras_values] = data[-1]
+
+        return parent_nodes
+
+    def prefetch(self, extras_values_list):
+        """Load the parent nodes of the processes that are about to be submitted in bulk.
+
+        They are then returned by ``get_parent_node_from_extras()`` without querying the database again.
+        """
+        self._parent_nodes = self.get_parent_nodes_from_extras(extras_values_list)
 
     def get_parent_node_from_extras(self, extras_values):
         """Return the Node instance (in the parent group) from the (unique) extras identifying it."""
         extras_projections = self.get_process_extra_projections()
         assert len(extras_values) == len(extras_projections), f"The extras must be of length {len(extras_projections)}"
+
+        if tuple(extras_values) in self._parent_nodes:
+            return self._parent_nodes[tuple(extras_values)]
+
         filters = dict(zip(extras_projections, extras_values))
 
         qbuild = orm.QueryBuilder()
@@ -48,23 +104,24 @@ class FromGroupSubmissionController(BaseSubmissionController):  # pylint: disabl
             )
         return results[0]
 
-    def get_all_extras_to_submit(self):
-        """Return a *set* of the values of all extras uniquely identifying all simulations that you want to submit.
+    def _get_parent_extras_query(self, projections=(), process_filters=None):
+        """Return a QueryBuilder projecting the unique extras of the nodes in the parent group.
 
-        Each entry of the set must be a tuple, in same order as the keys returned by get_extra_unique_keys().
-
-        They are taken from the extra_unique_keys from the group.
-        Note: the extra_unique_keys must actually form a unique set;
-        if this is not the case, an AssertionError will be raised.
+        :param projections: optional additional projections on the nodes, after the extras.
+        :param process_filters: optional filters on the nodes, on top of ``filters``.
         """
         extras_projections = self.get_process_extra_projections()
 
+        filters = self.filters
+        if process_filters:
+            filters = {"and": [filters, process_filters]} if filters else process_filters
+
         qbuild = orm.QueryBuilder()
         qbuild.append(orm.Group, filters={"id": self.parent_group.pk}, tag="group")
         qbuild.append(
             orm.Node,
-            project=extras_projections,
-            filters=self.filters,
+            project=extras_projections + list(projections),
+            filters=filters,
             tag="process",
             with_group="group",
         )
@@ -72,7 +129,211 @@ class FromGroupSubmissionController(BaseSubmissionController):  # pylint: disabl
         if self.order_by is not None:
             qbuild.order_by(self.order_by)
 
-        results = qbuild.all()
+        return qbuild
+
+    def _get_order_fields(self):
+        """Return the fields by which the parent nodes are ordered, as a list of ``(field, spec)`` tuples.
+
+        They are the fields of ``order_by`` followed by the PK, so that the order is total and the nodes can be paged
+        through with a keyset (see ``_get_parent_page()``). Each ``spec`` is a dictionary with the ``order`` (``asc`` or
+        ``desc``) and possibly the ``cast``, as accepted by ``QueryBuilder.order_by()``.
+        """
+        order_fields = []
+        for order_spec in self._get_parent_extras_query().as_dict()["order_by"]:
+            for tag, fields in order_spec.items():
+                if tag != "process":
+                    raise ValueError(f"Only the parent nodes can be ordered in `order_by`, got the tag `{tag}`.")
+                for field_spec in fields:
+                    for field, spec in field_spec.items():
+                        order_fields.append((field, spec))
+        if not order_fields or order_fields[-1][0] != "id":
+            order_fields.append(("id", {"order": "asc"}))
+        return order_fields
+
+    @staticmethod
+    def _get_keyset_condition(columns, order_fields, order_values, inclusive):
+        """Return the SQLAlchemy condition selecting the rows that come after the given values of the order fields.
+
+        The rows are ordered with NULL values last, for each field and in both directions (see ``_get_parent_page()``),
+        so a NULL value is only followed by other NULL values, and a non-NULL value is followed by the NULL values.
+
+        :param columns: the SQLAlchemy expressions of the order fields.
+        :param order_fields: the order fields, as returned by ``_get_order_fields()``.
+        :param order_values: the values of the order fields of the row to start after.
+        :param inclusive: if True, the row with the given values is selected as well.
+        """
+        clauses = []
+        equal = []
+        for index, (column, (_, spec), value) in enumerate(zip(columns, order_fields, order_values)):
+            last = index == len(order_fields) - 1
+            if value is None:
+                if inclusive and last:
+                    clauses.append(and_(*equal, column.is_(None)))
+                equal.append(column.is_(None))
+                continue
+            if spec.get("order", "asc") == "asc":
+                compare = operator.ge if inclusive and last else operator.gt
+            else:
+                compare = operator.le if inclusive and last else operator.lt
+            clauses.append(and_(*equal, or_(compare(column, value), column.is_(None))))
+            equal.append(column == value)
+        return or_(*clauses)
+
+    def _get_parent_page(self, after=None, unsubmitted_only=False):
+        """Return the next page of nodes in the parent group, in order, with the values of their ``order_by`` fields.
+
+        The nodes are ordered by the fields returned by ``_get_order_fields()``, with the nodes for which a field is not
+        defined (i.e. NULL) after the others, whatever the order and the database backend.
+
+        :param after: an optional tuple ``(order_values, inclusive)``, to only return the nodes that come after the one
+            with the given values of the fields returned by ``_get_order_fields()`` (or from it, if ``inclusive``).
+        :param unsubmitted_only: if True, only return the nodes for which there is no process with the same unique
+            extras in ``group_label``. This anti-join is done by the database, with a ``NOT EXISTS`` subquery.
+        :return: a list of tuples with the values of the unique extras followed by the values of the order fields (cast
+            as in ``order_by``).
+        """
+        order_fields = self._get_order_fields()
+        projections = [{field: {"cast": spec["cast"]}} if "cast" in spec else field for field, spec in order_fields]
+        qbuild = self._get_parent_extras_query(projections=projections)
+
+        storage_query = qbuild.backend.query()
+        if not hasattr(storage_query, "get_query"):
+            # Storage backends that are not based on SQLAlchemy: the submitted nodes are then skipped in Python
+            return self._get_parent_page_from_querybuilder(projections, order_fields, after)
+
+        built = storage_query.get_query(qbuild.as_dict())
+        columns = list(built.query.statement.selected_columns)[len(self.get_extra_unique_keys()) :]
+        query = built.query.order_by(None).order_by(
+            *[
+                (column.asc() if spec.get("order", "asc") == "asc" else column.desc()).nulls_last()
+                for column, (_, spec) in zip(columns, order_fields)
+            ]
+        )
+        if after is not None:
+            query = query.filter(self._get_keyset_condition(columns, order_fields, *after))
+
+        if unsubmitted_only:
+            parent = built.tag_to_alias["process"]
+            process = aliased(storage_query.Node)
+            group_nodes = storage_query.table_groups_nodes
+            conditions = [group_nodes.c.dbgroup_id == self.group.pk, group_nodes.c.dbnode_id == process.id]
+            for key in self.get_extra_unique_keys():
+                path = tuple(key.split("."))
+                path = path[0] if len(path) == 1 else path
+                conditions.append(process.extras[path] == parent.extras[path])
+            query = query.filter(~exists().where(*conditions))
+
+        return [tuple(row) for row in query.limit(QUERY_CHUNK_SIZE).all()]
+
+    def _get_parent_page_from_querybuilder(self, projections, order_fields, after=None):
+        """Return the next page of nodes in the parent group, with a keyset built from ``QueryBuilder`` filters.
+
+        The ``QueryBuilder`` cannot compare with NULL values, so the nodes must define all the fields of ``order_by``.
+        See ``_get_parent_page()`` for the parameters.
+        """
+        process_filters = None
+        if after is not None:
+            order_values, inclusive = after
+            for (field, _), value in zip(order_fields, order_values):
+                if value is None:
+                    raise ValueError(
+                        f"The parent nodes are ordered by `{field}`, which is not defined for all of them: this is "
+                        "not supported in streaming mode by this storage backend."
+                    )
+            keyset = []
+            for index, ((field, spec), value) in enumerate(zip(order_fields, order_values)):
+                comparison = ">" if spec.get("order", "asc") == "asc" else "<"
+                if inclusive and index == len(order_fields) - 1:
+                    comparison += "="
+                clause = [
+                    {prev_field: {"==": prev_value}}
+                    for (prev_field, _), prev_value in zip(order_fields, order_values[:index])
+                ]
+                keyset.append({"and": clause + [{field: {comparison: value}}]})
+            process_filters = {"or": keyset}
+
+        qbuild = self._get_parent_extras_query(projections=projections, process_filters=process_filters)
+        qbuild.order_by({"process": [{field: spec} for field, spec in order_fields]})
+        return qbuild.limit(QUERY_CHUNK_SIZE).all()
+
+    def _iter_parent_rows(self, after=None, unsubmitted_only=False):
+        """Yield the unique extras and the values of the order fields of the nodes in the parent group, in order.
+
+        The nodes are queried one page at a time, each page starting after the last node of the previous one (keyset
+        pagination), so that pages are separate short queries and never have to skip over the nodes already returned.
+        See ``_get_parent_page()`` for the parameters.
+        """
+        num_extras = len(self.get_extra_unique_keys())
+        while True:
+            page = self._get_parent_page(after=after, unsubmitted_only=unsubmitted_only)
+
+            for row in page:
+                extras_values = tuple(row[:num_extras])
+                assert all(extra is not None for extra in extras_values), (
+                    "There is at least one of the nodes in the parent group "
+                    "that does not define one of the required extras."
+                )
+                yield extras_values, tuple(row[num_extras:])
+
+            if len(page) < QUERY_CHUNK_SIZE:
+                return
+            after = (tuple(page[-1][num_extras:]), False)
+
+    def _iter_extras_to_run(self, submitted_extras):
+        """Yield the extras of the nodes in the parent group for which no process was submitted yet, lazily.
+
+        The database only returns the parent nodes without a process in ``group_label`` (see ``_get_parent_page()``),
+        in the order of ``order_by``, one page at a time. A cursor also remembers the node up to which all processes
+        were submitted (or belong to other shards), so that the next batches start from it. This cursor is reset when
+        the index of submitted processes is rebuilt (see ``full_rescan_interval``), to account for deleted processes and
+        for parent nodes added before the cursor; the fields of ``order_by`` should therefore not change over time.
+
+        If a subclass overrides ``get_all_extras_to_submit()`` (e.g. to narrow down the candidates), the extras that it
+        returns are checked one by one against the submitted processes instead, as for any other controller.
+        """
+        if type(self).get_all_extras_to_submit is not FromGroupSubmissionController.get_all_extras_to_submit:
+            yield from super()._iter_extras_to_run(submitted_extras)
+            return
+
+        if self._parent_cursor[0] != self._last_full_rescan:
+            self._parent_cursor = (self._last_full_rescan, None)
+
+        all_done = True
+        yielded = set()
+        for extras_values, order_values in self._iter_parent_rows(after=self._parent_cursor[1], unsubmitted_only=True):
+            # Nodes of other shards are never submitted by this controller, so the cursor can move past them
+            if (
+                extras_values in yielded
+                or not self._in_shard(extras_values)
+                or self._index_key(extras_values) in submitted_extras
+            ):
+                if all_done:
+                    self._parent_cursor = (self._last_full_rescan, (order_values, False))
+                continue
+            # All the nodes before the first one to submit are done, since the database did not return them
+            if all_done:
+                self._parent_cursor = (self._last_full_rescan, (order_values, True))
+            all_done = False
+            yielded.add(extras_values)
+            yield extras_values
+
+    def get_all_extras_to_submit(self):
+        """Return a *set* of the values of all extras uniquely identifying all simulations that you want to submit.
+
+        Each entry of the set must be a tuple, in same order as the keys returned by get_extra_unique_keys().
+
+        They are taken from the extra_unique_keys from the group.
+        Note: the extra_unique_keys must actually form a unique set;
+        if this is not the case, an AssertionError will be raised.
+
+        In streaming mode, a generator is returned instead, that queries the parent group one page at a time.
+        This is the recommended mode for large parent groups: each batch then only asks the database for the parent
+        nodes without a process in ``group_label``, and stops as soon as enough of them are found.
+        """
+        if self.streaming:
+            return (extras_values for extras_values, _ in self._iter_parent_rows())
+
+        results = self._get_parent_extras_query().all()
 
         # I return a set of results as required by the API
         # First, however, convert to a list of tuples otherwise
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Local write-ahead journal of the submissions, to recover the bookkeeping of processes after a crash."""
+import json
+import os
+import tempfile
+import time
+
+SUBMITTED = "submitted"
+"""A process was submitted for the given extras, with the given PK."""
+COMMITTED = "committed"
+"""The extras of the process with the given PK were set, and it was added to the group."""
+
+
+class SubmissionJournal:
+    """Append-only file recording, for each submission, the PK of the submitted process and the commit.
+
+    A process is submitted before its extras are set and before it is added to the group. If the controller stops in
+    between, the process is not found in the group and would be submitted again. The journal keeps track of the
+    processes that were submitted but not committed, so that their bookkeeping can be repaired at the next start.
+
+    Each entry is a line of JSON, synced to disk before returning. Once the file grows larger than ``max_size`` bytes,
+    it is compacted to the processes that were not committed yet, so that its size does not grow with the number of
+    submissions.
+    """
+
+    def __init__(self, path, max_size=1024 * 1024):
+        """Construct a journal writing to the file at the given path, which is created if needed.
+
+        :param path: the path of the journal file.
+        :param max_size: size in bytes above which the file is compacted after a commit.
+        """
+        self.path = os.fspath(path)
+        self.max_size = max_size
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._uncommitted = None
+
+    def _get_state(self):
+        """Return the processes that were submitted but not committed, replaying the file on the first call."""
+        if self._uncommitted is None:
+            self._uncommitted = self._replay()
+        return self._uncommitted
+
+    def _replay(self):
+        """Read the file and return the processes that were submitted but not committed.
+
+        A line that was only partially written (e.g. because of a crash) is ignored.
+        """
+        uncommitted = {}
+        if not os.path.exists(self.path):
+            return uncommitted
+
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["event"] == SUBMITTED:
+                    uncommitted[entry["pk"]] = (tuple(entry["extras"]), entry.get("attempt"))
+                elif entry["event"] == COMMITTED:
+                    uncommitted.pop(entry["pk"], None)
+        return uncommitted
+
+    def _write(self, entries):
+        """Append the given entries and sync the file to disk."""
+        if self._file is None:
+            self._file = open(self.path, "a+b")  # pylint: disable=consider-using-with
+            # Terminate a line that was partially written before a crash, so that the next entry is not lost with it
+            if self._file.tell() > 0:
+                self._file.seek(-1, os.SEEK_END)
+                if self._file.read(1) != b"\n":
+                    self._file.write(b"\n")
+        lines = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+        self._file.write(lines.encode("utf-8"))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record_submitted(self, extras_values, pk, attempt=None):
+        """Record that the process with the given PK was submitted for the given extras.
+
+        :param attempt: the number of the attempt, for resubmitted processes.
+        """
+        uncommitted = self._get_state()
+        entry = {"event": SUBMITTED, "extras": list(extras_values), "pk": pk, "time": time.time()}
+        if attempt is not None:
+            entry["attempt"] = attempt
+        self._write([entry])
+        uncommitted[pk] = (tuple(extras_values), attempt)
+
+    def record_committed(self, pks):
+        """Record that the bookkeeping of the processes with the given PKs was committed, with a single sync.
+
+        The file is then compacted if it is larger than ``max_size``.
+        """
+        uncommitted = self._get_state()
+        now = time.time()
+        self._write([{"event": COMMITTED, "pk": pk, "time": now} for pk in pks])
+        for pk in pks:
+            uncommitted.pop(pk, None)
+
+        if self._file.tell() > self.max_size:
+            self.compact()
+
+    def get_uncommitted(self):
+        """Return the processes that were submitted but whose bookkeeping was not committed.
+
+        :return: a dictionary where the keys are the PKs of the processes, and the values are tuples
+            ``(extras_values, attempt)``, with ``attempt`` being ``None`` for first attempts.
+        """
+        return dict(self._get_state())
+
+    def compact(self):
+        """Rewrite the journal with only the processes that were submitted but not committed.
+
+        The file is replaced atomically, so that it is never left partially written.
+        """
+        uncommitted = self._get_state()
+        self.close()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as handle:
+            for pk, (extras_values, attempt) in uncommitted.items():
+                entry = {"event": SUBMITTED, "extras": list(extras_values), "pk": pk}
+                if attempt is not None:
+                    entry["attempt"] = attempt
+                handle.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(handle.name, self.path)
+
+    def close(self):
+        """Close the journal file, if it is open. It is reopened at the next entry."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Timers and counters of the batch submissions, and sinks to export them."""
+import collections
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CycleMetrics:
+    """Time spent in each phase of a batch submission, and counters of what was done.
+
+    Phases and counters are identified by name; timings of the same phase are accumulated. They can be updated from
+    several threads at the same time.
+    """
+
+    def __init__(self, labels=None):
+        """Construct a new set of metrics, for a batch submission starting now.
+
+        :param labels: a dictionary of labels identifying the source of the metrics, e.g. the controller.
+        """
+        self.labels = dict(labels or {})
+        self.timestamp = time.time()
+        self.timings = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """Context manager adding the time spent in its body to the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[phase] += elapsed
+
+    def increment(self, counter, value=1):
+        """Increment the given counter."""
+        with self._lock:
+            self.counters[counter] += value
+
+    def as_dict(self):
+        """Return the metrics as a JSON-serializable dictionary.
+
+        The ``duration`` is the time elapsed since the metrics were created, and ``submissions_per_second`` is derived
+        from it and the ``submitted`` counter.
+        """
+        duration = time.perf_counter() - self._start
+        with self._lock:
+            return {
+                "timestamp": self.timestamp,
+                "labels": self.labels,
+                "duration": duration,
+                "submissions_per_second": self.counters.get("submitted", 0) / duration if duration > 0 else 0.0,
+                "timings": dict(self.timings),
+                "counters": dict(self.counters),
+            }
+
+
+class JsonLinesSink:
+    """Metrics sink appending the metrics of each batch submission as a line of JSON to a file."""
+
+    def __init__(self, path):
+        """Construct a new sink writing to the given file."""
+        self.path = path
+
+    def __call__(self, metrics):
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(metrics) + "\n")
+
+
+class PrometheusTextfileSink:
+    """Metrics sink writing the metrics in the Prometheus text format, e.g. for the textfile collector.
+
+    The file contains the timings and counters of the last batch submission of each source, together with counters
+    accumulated over all batch submissions. It is replaced atomically at each batch submission.
+    """
+
+    def __init__(self, path, prefix="aiida_submission_controller"):
+        """Construct a new sink writing to the given file.
+
+        :param prefix: prefix of the names of the metrics.
+        """
+        self.path = path
+        self.prefix = prefix
+        self._last = {}
+        self._totals = collections.defaultdict(float)
+
+    @staticmethod
+    def _format_labels(labels):
+        """Return the labels formatted for the Prometheus text format."""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+        return ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+
+    def __call__(self, metrics):
+        labels = self._format_labels(metrics["labels"])
+        self._last[labels] = metrics
+        for counter, value in metrics["counters"].items():
+            self._totals[(labels, counter)] += value
+
+        lines = [
+            f"# TYPE {self.prefix}_cycle_duration_seconds gauge",
+            f"# TYPE {self.prefix}_phase_duration_seconds gauge",
+            f"# TYPE {self.prefix}_submissions_per_second gauge",
+            f"# TYPE {self.prefix}_cycle_count gauge",
+            f"# TYPE {self.prefix}_count_total counter",
+        ]
+        for source_labels, last in self._last.items():
+            separator = "," if source_labels else ""
+            lines.append(f"{self.prefix}_cycle_duration_seconds{{{source_labels}}} {last['duration']}")
+            lines.append(f"{self.prefix}_submissions_per_second{{{source_labels}}} {last['submissions_per_second']}")
+            for phase, value in sorted(last["timings"].items()):
+                lines.append(
+                    f'{self.prefix}_phase_duration_seconds{{{source_labels}{separator}phase="{phase}"}} {value}'
+                )
+            for counter, value in sorted(last["counters"].items()):
+                lines.append(f'{self.prefix}_cycle_count{{{source_labels}{separator}name="{counter}"}} {value}')
+        for (source_labels, counter), value in sorted(self._totals.items()):
+            separator = "," if source_labels else ""
+            lines.append(f'{self.prefix}_count_total{{{source_labels}{separator}name="{counter}"}} {value}')
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8") as handle:
+            handle.write("\n".join(lines) + "\n")
+        os.replace(handle.name, self.path)
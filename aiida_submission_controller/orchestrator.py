@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""A class to run several submission controllers, sharing a global maximum of concurrent processes."""
+import contextlib
+import heapq
+import threading
+import time
+from typing import List, Optional
+
+from aiida import orm
+from pydantic import BaseModel, PrivateAttr, model_validator
+
+from .base import QUERY_CHUNK_SIZE, BaseSubmissionController, run_polling_loop
+
+
+class SubmissionOrchestrator(BaseModel):
+    """Orchestrator submitting new batches for several controllers, sharing a global maximum of active processes.
+
+    The active processes of all controllers are counted with the same queries, rather than with separate queries for
+    each controller. The available slots are then shared between the controllers so that their number of active
+    processes is proportional to their ``weights``, within the ``max_concurrent`` of each controller.
+
+    The orchestrator only uses the public interface of the controllers: ``active_pks``, ``active_max_pk`` and
+    ``seed_active_pks()`` to count their active processes, ``get_status_snapshot()`` and ``submit_new_batch()`` with
+    its ``snapshot`` to submit, ``collect_metrics()`` to collect the metrics of the whole cycle, and
+    ``has_extras_to_run()`` and ``has_submitted()`` to wait between cycles.
+    """
+
+    controllers: List[BaseSubmissionController]
+    """Controllers to submit new batches for. Each of them must manage a different group."""
+    max_concurrent: int
+    """Maximum concurrent active processes, over all controllers."""
+    weights: Optional[List[float]] = None
+    """Relative share of the active processes for each controller, in the same order. By default, all are equal."""
+    full_rescan_interval: Optional[float] = 600.0
+    """Number of seconds after which the active processes are searched for in the full groups again.
+
+    See ``BaseSubmissionController.full_rescan_interval``.
+    """
+
+    _last_full_rescan: Optional[float] = PrivateAttr(default=None)
+    _stop_event: threading.Event = PrivateAttr(default_factory=threading.Event)
+
+    @model_validator(mode="after")
+    def _check_controllers(self):
+        """Check that the groups are unique and that there is one weight per controller."""
+        group_labels = [controller.group_label for controller in self.controllers]
+        if len(set(group_labels)) != len(group_labels):
+            raise ValueError("Each controller must manage a different group.")
+        if self.weights is not None:
+            if len(self.weights) != len(self.controllers):
+                raise ValueError("There must be exactly one weight per controller.")
+            if any(weight < 0 for weight in self.weights):
+                raise ValueError("The weights cannot be negative.")
+        return self
+
+    def _get_query(self, projections, process_filters=None, only_active=False):
+        """Return a QueryBuilder projecting on the group label and the processes in the groups of all controllers."""
+        filters = {}
+        if only_active:
+            filters = {
+                "or": [
+                    {"attributes.sealed": False},
+                    {"attributes": {"!has_key": "sealed"}},
+                ]
+            }
+        if process_filters:
+            filters = {"and": [filters, process_filters]} if filters else process_filters
+
+        qbuild = orm.QueryBuilder()
+        qbuild.append(
+            orm.Group,
+            filters={"label": {"in": [controller.group_label for controller in self.controllers]}},
+            project="label",
+            tag="group",
+        )
+        qbuild.append(orm.ProcessNode, project=projections, filters=filters, tag="process", with_group="group")
+        return qbuild
+
+    def update_active_pks(self, full_rescan=False):
+        """Update the PKs of the active processes of all controllers at once.
+
+        As for a single controller, only the processes that were active and the ones with a PK higher than the highest
+        one seen so far are checked, except for a full rescan every ``full_rescan_interval`` seconds.
+
+        :return: a dictionary with the number of active processes in the group of each controller.
+        """
+        now = time.monotonic()
+        full_rescan = (
+            full_rescan
+            or self._last_full_rescan is None
+            or self.full_rescan_interval is None
+            or now - self._last_full_rescan >= self.full_rescan_interval
+        )
+        active_pks = {controller.group_label: set() for controller in self.controllers}
+
+        if full_rescan:
+            qbuild = (
+                orm.QueryBuilder().append(orm.ProcessNode, project="id").order_by({orm.ProcessNode: {"id": "desc"}})
+            )
+            max_pk = qbuild.limit(1).first(flat=True) or 0
+            for label, pk in self._get_query(["id"], only_active=True).all():
+                active_pks[label].add(pk)
+            self._last_full_rescan = now
+        else:
+            max_pk = min(controller.active_max_pk for controller in self.controllers)
+            known_active = list(set().union(*(controller.active_pks for controller in self.controllers)))
+            for start in range(0, len(known_active), QUERY_CHUNK_SIZE):
+                qbuild = self._get_query(
+                    ["id"], {"id": {"in": known_active[start : start + QUERY_CHUNK_SIZE]}}, only_active=True
+                )
+                for label, pk in qbuild.all():
+                    active_pks[label].add(pk)
+
+            new_max_pk = max_pk
+            for label, pk, sealed in self._get_query(["id", "attributes.sealed"], {"id": {">": max_pk}}).all():
+                new_max_pk = max(new_max_pk, pk)
+                if not sealed:
+                    active_pks[label].add(pk)
+            max_pk = new_max_pk
+
+        for controller in self.controllers:
+            controller.seed_active_pks(active_pks[controller.group_label], max_pk, full_rescan=full_rescan)
+
+        return {label: len(pks) for label, pks in active_pks.items()}
+
+    def allocate_slots(self, num_active, num_candidates=None):
+        """Share the available slots between the controllers.
+
+        Slots are assigned one at a time to the controller with the lowest number of active (and assigned) processes
+        relative to its weight, without exceeding its own ``effective_max_concurrent`` nor the number of processes it
+        can submit.
+
+        :param num_active: a dictionary with the number of active processes in the group of each controller.
+        :param num_candidates: an optional dictionary with the number of processes that each controller can submit, by
+            group label. By default, it is not limited.
+        :return: a list with the number of processes that each controller can submit, in the same order.
+        """
+        weights = self.weights or [1.0] * len(self.controllers)
+        available = max(0, self.max_concurrent - sum(num_active.values()))
+        allocated = [0] * len(self.controllers)
+
+        limits = []
+        for controller in self.controllers:
+            limit = controller.effective_max_concurrent
+            if num_candidates is not None:
+                limit = min(limit, num_active[controller.group_label] + num_candidates[controller.group_label])
+            limits.append(limit)
+
+        heap = []
+        for index, (controller, weight) in enumerate(zip(self.controllers, weights)):
+            if weight > 0 and limits[index] > num_active[controller.group_label]:
+                heapq.heappush(heap, (num_active[controller.group_label] / weight, index))
+
+        while available > 0 and heap:
+            _, index = heapq.heappop(heap)
+            controller = self.controllers[index]
+            allocated[index] += 1
+            available -= 1
+            num_controller = num_active[controller.group_label] + allocated[index]
+            if num_controller < limits[index]:
+                heapq.heappush(heap, (num_controller / weights[index], index))
+
+        return allocated
+
+    def submit_new_batch(self, **kwargs):
+        """Submit a new batch for each controller, within their share of the global maximum of active processes.
+
+        The status of each controller is computed once, before sharing the slots, so that the slots that a controller
+        cannot use, because it has fewer processes left to submit, are given to the other controllers from the start.
+        Each controller then submits its batch from that same status, without querying it again.
+
+        The metrics of each controller (see ``metrics_sink``) cover the whole cycle, including the computation of its
+        status, and the time spent counting the active processes of all controllers as the ``update_active_pks`` phase.
+
+        :param kwargs: passed on to ``submit_new_batch()`` of each controller. With ``dry_run``, the status of the
+            controllers is computed without changing their state (see ``get_status_snapshot()``).
+        :return: a dictionary where the keys are the group labels of the controllers and the values the dictionaries
+            of submitted processes returned by each controller.
+        """
+        with contextlib.ExitStack() as stack:
+            metrics = [stack.enter_context(controller.collect_metrics()) for controller in self.controllers]
+
+            with contextlib.ExitStack() as timers:
+                for cycle_metrics in metrics:
+                    if cycle_metrics is not None:
+                        timers.enter_context(cycle_metrics.timer("update_active_pks"))
+                num_active = self.update_active_pks()
+
+            read_only = kwargs.get("dry_run", False)
+            snapshots = [controller.get_status_snapshot(read_only=read_only) for controller in self.controllers]
+            num_candidates = {
+                controller.group_label: snapshot.count_candidates(snapshot.num_available_slots)
+                for controller, snapshot in zip(self.controllers, snapshots)
+            }
+            allocated = self.allocate_slots(num_active, num_candidates)
+
+            submitted = {controller.group_label: {} for controller in self.controllers}
+            for controller, snapshot, max_to_submit in zip(self.controllers, snapshots, allocated):
+                if max_to_submit > 0:
+                    submitted[controller.group_label] = controller.submit_new_batch(
+                        max_to_submit=max_to_submit, snapshot=snapshot, **kwargs
+                    )
+
+        return submitted
+
+    def run_forever(
+        self,
+        poll_interval=60.0,
+        max_poll_interval=600.0,
+        backoff_factor=2.0,
+        stop_when_done=True,
+        events=None,
+        event_debounce=1.0,
+        **kwargs,
+    ):
+        """Keep submitting new batches for all controllers, until stopped.
+
+        See ``BaseSubmissionController.run_forever()`` for the meaning of the parameters.
+        """
+
+        def is_done():
+            return stop_when_done and all(
+                controller.num_active_slots == 0 and not controller.has_extras_to_run()
+                for controller in self.controllers
+            )
+
+        run_polling_loop(
+            lambda: any(self.submit_new_batch(**kwargs).values()),
+            is_done,
+            self._stop_event,
+            poll_interval=poll_interval,
+            max_poll_interval=max_poll_interval,
+            backoff_factor=backoff_factor,
+            events=events,
+            is_relevant=lambda pk: any(controller.has_submitted(pk) for controller in self.controllers),
+            event_debounce=event_debounce,
+        )
+
+    def stop(self):
+        """Request ``run_forever()`` to return after the current cycle."""
+        self._stop_event.set()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Simulation of the schedule of a whole campaign, to size the resources before submitting it."""
+import heapq
+import itertools
+import statistics
+from typing import List, NamedTuple
+
+from aiida.common import timezone
+from pydantic import BaseModel
+from rich.console import Console
+from rich.table import Table
+
+from .base import QUERY_CHUNK_SIZE
+
+
+class CampaignPlan(BaseModel):
+    """Projected schedule of the remaining processes of a controller, for a given ``max_concurrent``."""
+
+    max_concurrent: int
+    """Maximum concurrent active processes used in the simulation."""
+    num_processes: int
+    """Number of processes that remain to be submitted."""
+    num_active: int
+    """Number of processes that were active at the start of the simulation."""
+    makespan: float
+    """Seconds until all processes, including the ones that were active, are expected to be completed."""
+    busy_time: float
+    """Total runtime of all processes within the makespan, in seconds (e.g. to multiply by the cores per process)."""
+    utilisation: float
+    """Fraction of the slots (``max_concurrent`` times the makespan) that are occupied by a process."""
+    mean_wait: float
+    """Average number of seconds before a process is submitted."""
+    num_estimated_from_history: int
+    """Number of processes whose runtime is estimated from the processes that already finished in the group."""
+
+
+def get_historical_runtime(controller, limit=1000):
+    """Return the median runtime, in seconds, of the latest processes of the group that finished successfully.
+
+    The runtime of a process is approximated as the time between its creation and its last modification.
+
+    :param limit: maximum number of processes to consider, the most recent ones first.
+    :return: the median runtime, or ``None`` if no process finished yet.
+    """
+    qbuild = controller.get_query(
+        process_projections=["ctime", "mtime"],
+        process_filters={"attributes.process_state": "finished", "attributes.exit_status": 0},
+    )
+    qbuild.order_by({"process": {"id": "desc"}}).limit(limit)
+    runtimes = [(mtime - ctime).total_seconds() for ctime, mtime in qbuild.all()]
+    return statistics.median(runtimes) if runtimes else None
+
+
+class _Workload(NamedTuple):
+    """Remaining workload of a controller, with the estimated runtimes, as simulated by ``plan_campaign()``."""
+
+    active_remaining: List[float]
+    """Estimated remaining runtime of each of the active processes, in seconds."""
+    runtimes: List[float]
+    """Estimated runtime of each of the processes to submit, in seconds, in the order in which they are submitted."""
+    num_estimated_from_history: int
+    """Number of runtimes that are estimated from the processes that already finished in the group."""
+
+
+def _get_workload(controller, sort=False, default_runtime=None):
+    """Return the remaining ``_Workload`` of the controller, without changing its state.
+
+    See ``plan_campaign()`` for the parameters.
+    """
+    snapshot = controller.get_status_snapshot(read_only=True)
+    extras_to_run = list(snapshot.extras_to_run)
+    extras_to_retry = list(snapshot.extras_to_retry)
+    if sort:
+        extras_to_run = list(controller.order_by_priority(extras_to_run))
+        extras_to_retry = list(controller.order_by_priority(extras_to_retry))
+    if controller.retry_policy == "first":
+        queue = extras_to_retry + extras_to_run
+    else:
+        queue = extras_to_run + extras_to_retry
+
+    historical_runtime = []
+    num_from_history = 0
+
+    def get_runtime(extras_values):
+        nonlocal num_from_history
+        runtime = controller.estimate_runtime(extras_values)
+        if runtime is not None:
+            return runtime
+        if not historical_runtime:
+            historical_runtime.append(get_historical_runtime(controller))
+        if historical_runtime[0] is not None:
+            num_from_history += 1
+            return historical_runtime[0]
+        if default_runtime is not None:
+            return default_runtime
+        raise ValueError(
+            f"Cannot estimate the runtime of the process with extras <{extras_values}>: implement "
+            "`estimate_runtime()` or pass a `default_runtime`."
+        )
+
+    active_remaining = [
+        max(0.0, get_runtime(extras_values) - age) for extras_values, age in _get_active_extras_and_ages(controller)
+    ]
+    runtimes = [get_runtime(extras_values) for extras_values in queue]
+    return _Workload(active_remaining, runtimes, num_from_history)
+
+
+def _simulate(workload, max_concurrent, poll_interval=None, max_submission_rate=None, submission_burst=1):
+    """Simulate the submission of the workload and return the ``CampaignPlan``.
+
+    See ``plan_campaign()`` for the parameters.
+    """
+    if max_concurrent < 1:
+        raise ValueError(f"`max_concurrent` must be at least 1, got {max_concurrent}.")
+
+    running = list(workload.active_remaining)
+    heapq.heapify(running)
+    busy_time = sum(workload.active_remaining)
+
+    now = 0.0
+    total_wait = 0.0
+    tokens, last_refill = float(submission_burst), 0.0
+    for runtime in workload.runtimes:
+        # Wait for a free slot (and for the next poll, if polling)
+        while len(running) >= max_concurrent:
+            now = max(now, heapq.heappop(running))
+        while running and running[0] <= now:
+            heapq.heappop(running)
+        if poll_interval:
+            now = -(-now // poll_interval) * poll_interval
+
+        if max_submission_rate:
+            tokens = min(submission_burst, tokens + (now - last_refill) * max_submission_rate)
+            if tokens < 1:
+                now += (1 - tokens) / max_submission_rate
+                tokens = 1.0
+            tokens -= 1
+            last_refill = now
+
+        heapq.heappush(running, now + runtime)
+        busy_time += runtime
+        total_wait += now
+
+    num_processes = len(workload.runtimes)
+    makespan = max(itertools.chain([now], running))
+    return CampaignPlan(
+        max_concurrent=max_concurrent,
+        num_processes=num_processes,
+        num_active=len(workload.active_remaining),
+        makespan=makespan,
+        busy_time=busy_time,
+        utilisation=busy_time / (max_concurrent * makespan) if makespan else 0.0,
+        mean_wait=total_wait / num_processes if num_processes else 0.0,
+        num_estimated_from_history=workload.num_estimated_from_history,
+    )
+
+
+def plan_campaign(
+    controller,
+    max_concurrent=None,
+    sort=False,
+    poll_interval=None,
+    default_runtime=None,
+    max_submission_rate=None,
+    submission_burst=None,
+):
+    """Simulate the policy of the controller over all the processes that remain to be submitted.
+
+    The runtime of each process is taken from ``controller.estimate_runtime()``, or else from the median runtime of the
+    processes of the group that already finished (see ``get_historical_runtime()``), or else ``default_runtime``. The
+    processes that are active at the start take a slot for the rest of their estimated runtime. Submission itself is
+    assumed to take no time, and limits per resource are not simulated.
+
+    The controller is only read: in particular, its adaptive limit (see ``adaptive_concurrency``) is left untouched.
+
+    :param max_concurrent: maximum concurrent active processes. By default, the one of the controller (or the share of
+        its shard).
+    :param sort: if True, submit the processes in order of priority, as ``submit_new_batch(sort=True)``.
+    :param poll_interval: if specified, new processes are submitted only every ``poll_interval`` seconds, as with
+        ``run_forever()``. Otherwise, slots are refilled as soon as they are freed, as with termination events.
+    :param default_runtime: runtime in seconds of the processes that cannot be estimated otherwise.
+    :param max_submission_rate: maximum submissions per second. By default, the one of the controller.
+    :param submission_burst: submissions that can be performed at once. By default, the one of the controller.
+    :return: a ``CampaignPlan``.
+    """
+    if max_concurrent is None:
+        max_concurrent = controller.shard_max_concurrent
+    return sweep_max_concurrent(
+        controller,
+        [max_concurrent],
+        sort=sort,
+        poll_interval=poll_interval,
+        default_runtime=default_runtime,
+        max_submission_rate=max_submission_rate,
+        submission_burst=submission_burst,
+    )[0]
+
+
+def _get_active_extras_and_ages(controller):
+    """Return a list of tuples with the extras and the age in seconds of the active processes of the controller."""
+    active_pks = list(controller.shard_active_pks)
+    projections = controller.get_process_extra_projections() + ["ctime"]
+    now = timezone.now()
+    results = []
+    for start in range(0, len(active_pks), QUERY_CHUNK_SIZE):
+        qbuild = controller.get_query(
+            process_projections=projections,
+            process_filters={"id": {"in": active_pks[start : start + QUERY_CHUNK_SIZE]}},
+        )
+        results.extend((tuple(data[:-1]), (now - data[-1]).total_seconds()) for data in qbuild.all())
+    return results
+
+
+def sweep_max_concurrent(
+    controller,
+    values,
+    sort=False,
+    poll_interval=None,
+    default_runtime=None,
+    max_submission_rate=None,
+    submission_burst=None,
+):
+    """Plan the campaign for each of the given values of ``max_concurrent``, to compare their effect.
+
+    The remaining workload and the estimated runtimes are computed once, and then simulated for each value.
+
+    :param values: an iterable of values of ``max_concurrent``.
+    :return: a list of ``CampaignPlan``, one per value.
+
+    See ``plan_campaign()`` for the other parameters.
+    """
+    if max_submission_rate is None:
+        max_submission_rate = controller.max_submission_rate
+    if submission_burst is None:
+        submission_burst = controller.submission_burst
+
+    workload = _get_workload(controller, sort=sort, default_runtime=default_runtime)
+    return [
+        _simulate(
+            workload,
+            value,
+            poll_interval=poll_interval,
+            max_submission_rate=max_submission_rate,
+            submission_burst=submission_burst,
+        )
+        for value in values
+    ]
+
+
+def print_campaign_plans(plans, time_unit="h"):
+    """Print a table comparing campaign plans.
+
+    :param plans: a list of ``CampaignPlan``.
+    :param time_unit: unit of the times in the table: ``s``, ``min``, ``h`` or ``d``.
+    """
+    seconds_per_unit = {"s": 1, "min": 60, "h": 3600, "d": 86400}[time_unit]
+
+    table = Table(title="Campaign plan")
+
+    table.add_column("Max active", justify="left", style="cyan", no_wrap=True)
+    table.add_column("To run", justify="left", style="cyan", no_wrap=True)
+    table.add_column(f"Makespan [{time_unit}]", justify="left", style="cyan", no_wrap=True)
+    table.add_column(f"Busy time [{time_unit}]", justify="left", style="cyan", no_wrap=True)
+    table.add_column("Utilisation", justify="left", style="cyan", no_wrap=True)
+    table.add_column(f"Mean wait [{time_unit}]", justify="left", style="cyan", no_wrap=True)
+
+    for plan in plans:
+        table.add_row(
+            str(plan.max_concurrent),
+            str(plan.num_processes),
+            f"{plan.makespan / seconds_per_unit:.2f}",
+            f"{plan.busy_time / seconds_per_unit:.2f}",
+            f"{plan.utilisation:.1%}",
+            f"{plan.mean_wait / seconds_per_unit:.2f}",
+        )
+    Console().print(table)
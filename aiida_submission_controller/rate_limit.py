@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Rate limiting of the submissions."""
+import time
+
+
+class TokenBucket:
+    """Token bucket limiting how often an action can be performed.
+
+    The bucket holds at most ``burst`` tokens and is refilled with ``rate`` tokens per second. Each action consumes a
+    token, so that up to ``burst`` actions can be performed at once, and ``rate`` actions per second on average.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Construct a new token bucket, initially full.
+
+        :param rate: number of tokens added to the bucket per second.
+        :param burst: maximum number of tokens in the bucket.
+        """
+        if rate <= 0:
+            raise ValueError(f"The rate must be positive, got {rate}.")
+        if burst < 1:
+            raise ValueError(f"The burst size must be at least 1, got {burst}.")
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        """Add the tokens accumulated since the last refill."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def time_until_available(self):
+        """Return the number of seconds until a token is available, without consuming it."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def try_acquire(self):
+        """Consume a token if one is available and return whether it was."""
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def acquire(self):
+        """Consume a token, waiting until one is available."""
+        while not self.try_acquire():
+            time.sleep(self.time_until_available())
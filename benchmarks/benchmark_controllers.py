@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the submission controllers on synthetic groups of process nodes.
+
+For each requested size, a group with that number of process nodes (of which a fraction is active) and a parent group
+with slightly more data nodes are created in bulk. A batch is then submitted a few times (see ``--cycles``) with each
+controller, with a mocked ``engine.submit``, measuring the latency of each cycle, the number of SQL statements and the
+peak memory allocated in Python. The results are written as JSON.
+
+The nodes and groups are created in the current profile, so use a dedicated, disposable profile, e.g.:
+
+    verdi -p benchmark run benchmarks/benchmark_controllers.py --sizes 10000 100000 --output results.json
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import uuid
+from unittest import mock
+
+from aiida import engine, load_profile, orm
+from aiida.common.timezone import now
+from aiida.manage import get_manager
+from sqlalchemy import event
+
+from aiida_submission_controller import BaseSubmissionController, FromGroupSubmissionController
+
+INSERT_CHUNK_SIZE = 10000
+"""Number of nodes inserted in the database at once."""
+
+
+class RangeSubmissionController(BaseSubmissionController):
+    """Controller submitting one process for each integer in a range."""
+
+    num_items: int
+    """Number of processes to submit in total."""
+
+    def get_all_extras_to_submit(self):
+        return {(index,) for index in range(self.num_items)}
+
+    def get_inputs_and_processclass_from_extras(self, extras_values):
+        return None
+
+
+class ParentSubmissionController(FromGroupSubmissionController):
+    """Controller submitting one process for each node in the parent group."""
+
+    def get_inputs_and_processclass_from_extras(self, extras_values):
+        return self.get_parent_node_from_extras(extras_values)
+
+
+def mock_submit(_):
+    """Replacement of ``engine.submit``, creating and storing a process node without running it."""
+    node = orm.WorkflowNode()
+    node.set_process_state("created")
+    return node.store()
+
+
+def create_group(label, num_nodes, node_type, get_attributes):
+    """Create a group and add ``num_nodes`` new nodes to it, inserting them in bulk.
+
+    :param get_attributes: a callable returning the attributes of the node with the given index.
+    """
+    storage = get_manager().get_profile_storage()
+    group = orm.Group(label=label).store()
+    user_id = orm.User.collection.get_default().pk
+
+    for start in range(0, num_nodes, INSERT_CHUNK_SIZE):
+        rows = [
+            {
+                "uuid": str(uuid.uuid4()),
+                "node_type": node_type,
+                "user_id": user_id,
+                "ctime": now(),
+                "mtime": now(),
+                "attributes": get_attributes(index),
+                "extras": {"index": index},
+            }
+            for index in range(start, min(start + INSERT_CHUNK_SIZE, num_nodes))
+        ]
+        with storage.transaction():
+            pks = storage.bulk_insert(orm.EntityTypes.NODE, rows, allow_defaults=True)
+            storage.bulk_insert(
+                orm.EntityTypes.GROUP_NODE,
+                [{"dbnode_id": pk, "dbgroup_id": group.pk} for pk in pks],
+                allow_defaults=True,
+            )
+
+    return group
+
+
+def measure_cycle(controller, **kwargs):
+    """Submit a new batch with the given controller and measure the latency, SQL statements and peak memory.
+
+    :return: a tuple with the dictionary of measurements and the dictionary of submitted processes.
+    """
+    statements = []
+
+    def count_statement(*_):
+        statements.append(None)
+
+    bind = get_manager().get_profile_storage().get_session().get_bind()
+    event.listen(bind, "before_cursor_execute", count_statement)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with mock.patch.object(engine, "submit", mock_submit):
+            submitted = controller.submit_new_batch(**kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        event.remove(bind, "before_cursor_execute", count_statement)
+
+    measurements = {
+        "seconds": seconds,
+        "queries": len(statements),
+        "peak_memory_bytes": peak_memory,
+        "submitted": len(submitted),
+    }
+    return measurements, submitted
+
+
+def run_benchmark(size, batch_size, active_fraction, cycles):
+    """Run the benchmark for groups of the given size and return a list of result records."""
+    prefix = f"benchmark/{uuid.uuid4().hex[:8]}"
+    num_active = int(size * active_fraction)
+
+    parent_group = create_group(
+        f"{prefix}/parents", size + cycles * batch_size, "data.core.int.Int.", lambda index: {"value": index}
+    )
+
+    def get_process_attributes(index):
+        if index < num_active:
+            return {"process_state": "running", "sealed": False}
+        return {"process_state": "finished", "exit_status": 0, "sealed": True}
+
+    common = {"max_concurrent": num_active + batch_size, "unique_extra_keys": ("index",)}
+    controllers = {
+        "BaseSubmissionController": lambda group: RangeSubmissionController(
+            group_label=group.label, num_items=size + cycles * batch_size, **common
+        ),
+        "FromGroupSubmissionController": lambda group: ParentSubmissionController(
+            group_label=group.label, parent_group_label=parent_group.label, **common
+        ),
+        "FromGroupSubmissionController (streaming)": lambda group: ParentSubmissionController(
+            group_label=group.label, parent_group_label=parent_group.label, streaming=True, **common
+        ),
+    }
+
+    results = []
+    for name, get_controller in controllers.items():
+        group = create_group(f"{prefix}/{len(results)}", size, "process.workflow.WorkflowNode.", get_process_attributes)
+        controller = get_controller(group)
+        submitted = {}
+        for cycle in range(cycles):
+            # Make room for the next batch, as if the processes of the previous one had completed
+            for node in submitted.values():
+                node.seal()
+            record = {"controller": name, "size": size, "batch_size": batch_size, "cycle": cycle}
+            measurements, submitted = measure_cycle(controller)
+            record.update(measurements)
+            results.append(record)
+            print(json.dumps(record))
+
+    return results
+
+
+def main():
+    """Run the benchmark with the command line arguments and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Sizes of the groups.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Number of processes submitted per cycle.")
+    parser.add_argument("--active-fraction", type=float, default=0.01, help="Fraction of active processes.")
+    parser.add_argument("--cycles", type=int, default=2, help="Number of cycles per controller.")
+    parser.add_argument("--output", default="benchmark_results.json", help="File to write the results to.")
+    args = parser.parse_args()
+
+    load_profile()
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_benchmark(size, args.batch_size, args.active_fraction, args.cycles))
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
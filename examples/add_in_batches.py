@@ -99,7 +99,9 @@ def main():
         print("    Legend:")
         print("      ###: not yet submitted")
         print("      ???: submitted, but no results (not finished or failed)")
-        all_submitted = controller.get_all_submitted_processes()
+        all_submitted = dict(
+            controller.iter_submitted_process_rows(projections=[], output_projections={"sum": ["attributes.value"]})
+        )
         sys.stdout.write("   |")
         for right in range(1, 13):
             sys.stdout.write(f"{right:3d} ")
@@ -111,14 +113,13 @@ def main():
         for left in range(1, 13):
             sys.stdout.write(f"{left:2d} |")
             for right in range(1, 13):
-                process = all_submitted.get((left, right))
-                if process is None:
+                row = all_submitted.get((left, right))
+                if row is None:
                     result = "###"  # No node
+                elif row[0] is None:
+                    result = "???"  # Probably not completed, does not have output 'sum'
                 else:
-                    try:
-                        result = f"{process.outputs.sum.value:3d}"
-                    except AttributeError:
-                        result = "???"  # Probably not completed, does not have output 'sum'
+                    result = f"{row[0]:3d}"
                 sys.stdout.write(result + " ")
             sys.stdout.write("\n")
 
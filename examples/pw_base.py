@@ -2,8 +2,6 @@
 # -*- coding: utf-8 -*-
 """An example of a SubmissionController implementation for a small set of PwBaseWorkChains."""
 
-import time
-
 from aiida import load_profile, orm
 from aiida_quantumespresso.workflows.pw.base import PwBaseWorkChain
 from ase.build import bulk
@@ -56,9 +54,7 @@ def main():
         max_concurrent=1,
         pw_code="pw@localhost",  # Replace with the label of a code configured for Quantum ESPRESSO pw.x
     )
-    while True:
-        controller.submit_new_batch(verbose=True)
-        time.sleep(30)
+    controller.run_forever(poll_interval=30, verbose=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Fixtures shared by the tests, on top of the ones of ``aiida-core`` providing a temporary profile."""
+import uuid
+
+import pytest
+from aiida import engine, orm
+
+pytest_plugins = ["aiida.tools.pytest_fixtures"]
+
+
+@pytest.fixture
+def new_group():
+    """Return a function storing and returning a new group with a unique label."""
+
+    def factory():
+        return orm.Group(label=f"test/{uuid.uuid4().hex}").store()
+
+    return factory
+
+
+@pytest.fixture
+def fake_submit(monkeypatch):
+    """Replace ``engine.submit`` with a function storing an unsealed ``WorkflowNode``, and return the stored nodes."""
+    submitted = []
+
+    def submit(builder, **kwargs):  # pylint: disable=unused-argument
+        node = orm.WorkflowNode().store()
+        submitted.append(node)
+        return node
+
+    monkeypatch.setattr(engine, "submit", submit)
+    return submitted
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Tests for the ``FromGroupSubmissionController``, in particular the keyset pagination of the parent group."""
+import pytest
+from aiida import orm
+
+from aiida_submission_controller import FromGroupSubmissionController, from_group
+
+PAGE_SIZE = 3
+"""Number of parent nodes per page, small enough for the pages to end on all kinds of values."""
+
+
+class Controller(FromGroupSubmissionController):  # pylint: disable=abstract-method
+    """Controller submitting a dummy process for each parent node."""
+
+    def get_inputs_and_processclass_from_extras(self, extras_values):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    """Query the parent nodes with small pages."""
+    monkeypatch.setattr(from_group, "QUERY_CHUNK_SIZE", PAGE_SIZE)
+
+
+@pytest.fixture
+def parent_group(new_group):
+    """Return a parent group of 20 nodes with a unique extra ``k``, and an extra ``w`` only defined for some."""
+    group = new_group()
+    for index in range(20):
+        node = orm.Int(index).store()
+        node.base.extras.set("k", index)
+        if index % 3:
+            node.base.extras.set("w", index % 4)
+        group.add_nodes(node)
+    return group
+
+
+def expected_order(group, order="asc"):
+    """Return the ``k`` extras of the nodes of the group, by ``w`` with the undefined ones last, and then by PK."""
+    nodes = sorted(group.nodes, key=lambda node: node.pk)
+    with_w = [node for node in nodes if "w" in node.base.extras.keys()]
+    without_w = [node for node in nodes if "w" not in node.base.extras.keys()]
+    with_w.sort(key=lambda node: node.base.extras.get("w"), reverse=order == "desc")
+    if order == "desc":
+        # The sort is stable, so the PKs must be put back in ascending order within the same value of ``w``
+        with_w.sort(key=lambda node: (-node.base.extras.get("w"), node.pk))
+    return [(node.base.extras.get("k"),) for node in with_w + without_w]
+
+
+def seal_all(group):
+    """Seal all the processes in the group, so that they are not active anymore."""
+    for node in group.nodes:
+        if not node.is_sealed:
+            node.seal()
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_parent_rows_with_undefined_order_field(parent_group, new_group, order):
+    """The pages go through all the parent nodes once, in order, even if pages end on undefined ``order_by`` fields."""
+    controller = Controller(
+        group_label=new_group().label,
+        parent_group_label=parent_group.label,
+        max_concurrent=5,
+        unique_extra_keys=("k",),
+        order_by={"process": [{"extras.w": {"order": order, "cast": "i"}}]},
+    )
+    rows = list(controller._iter_parent_rows())  # pylint: disable=protected-access
+    assert [extras_values for extras_values, _ in rows] == expected_order(parent_group, order)
+    # Pages ending on undefined values are the ones that used to fail
+    assert any(order_values[0] is None for _, order_values in rows[PAGE_SIZE - 1 :: PAGE_SIZE])
+
+
+def test_parent_page_inclusive(parent_group, new_group):
+    """A page starting from a node includes it, and one starting after it does not."""
+    controller = Controller(
+        group_label=new_group().label,
+        parent_group_label=parent_group.label,
+        max_concurrent=5,
+        unique_extra_keys=("k",),
+        order_by={"process": [{"extras.w": {"order": "asc", "cast": "i"}}]},
+    )
+    rows = controller._get_parent_page()  # pylint: disable=protected-access
+    last = rows[-1][1:]
+    assert controller._get_parent_page(after=(last, True))[0] == rows[-1]  # pylint: disable=protected-access
+    assert controller._get_parent_page(after=(last, False))[0] != rows[-1]  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_submit_with_undefined_order_field(parent_group, new_group, fake_submit, streaming):
+    """All the parent nodes are submitted once, and the controller then has nothing left to run."""
+    group = new_group()
+    controller = Controller(
+        group_label=group.label,
+        parent_group_label=parent_group.label,
+        max_concurrent=7,
+        unique_extra_keys=("k",),
+        order_by={"process": [{"extras.w": {"order": "asc", "cast": "i"}}]},
+        streaming=streaming,
+    )
+    submitted = []
+    while controller.has_extras_to_run():
+        batch = controller.submit_new_batch()
+        assert batch
+        submitted.extend(batch)
+        seal_all(group)
+
+    if streaming:
+        assert submitted == expected_order(parent_group)
+    else:
+        # Without the keyset, the nodes with undefined values are ordered as the database orders NULL values
+        assert sorted(submitted) == sorted(expected_order(parent_group))
+    assert len(fake_submit) == 20
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_overridden_extras_to_submit(parent_group, new_group, fake_submit, streaming):
+    """A subclass narrowing down the extras to submit is respected, also to know whether there is anything to run."""
+
+    class EvenController(Controller):  # pylint: disable=abstract-method
+        """Controller only submitting the parent nodes with an even ``k``."""
+
+        def get_all_extras_to_submit(self):
+            return [extras_values for extras_values in super().get_all_extras_to_submit() if extras_values[0] % 2 == 0]
+
+    group = new_group()
+    controller = EvenController(
+        group_label=group.label,
+        parent_group_label=parent_group.label,
+        max_concurrent=20,
+        unique_extra_keys=("k",),
+        streaming=streaming,
+    )
+    assert sorted(controller.submit_new_batch()) == [(index,) for index in range(0, 20, 2)]
+    seal_all(group)
+    assert not controller.has_extras_to_run()
+    assert not controller.submit_new_batch()
+    assert len(fake_submit) == 10
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Tests for the ``SubmissionJournal``."""
+import json
+
+from aiida_submission_controller.journal import SubmissionJournal
+
+
+def read_lines(path):
+    """Return the lines of the journal file."""
+    with open(path, encoding="utf-8") as handle:
+        return handle.read().splitlines()
+
+
+def test_replay(tmp_path):
+    """Only the processes that were submitted and not committed are returned, also by a new journal."""
+    path = tmp_path / "journal.jsonl"
+    journal = SubmissionJournal(path)
+    journal.record_submitted((1, "a"), 10)
+    journal.record_submitted((2, "b"), 11, attempt=2)
+    journal.record_submitted((3, "c"), 12)
+    journal.record_committed([10, 12])
+    journal.close()
+
+    assert journal.get_uncommitted() == {11: ((2, "b"), 2)}
+    assert SubmissionJournal(path).get_uncommitted() == {11: ((2, "b"), 2)}
+
+
+def test_replay_missing_file(tmp_path):
+    """A journal whose file does not exist yet has nothing uncommitted, and creates the parent directories."""
+    journal = SubmissionJournal(tmp_path / "sub" / "journal.jsonl")
+    assert journal.get_uncommitted() == {}
+    assert (tmp_path / "sub").is_dir()
+
+
+def test_replay_partial_last_line(tmp_path):
+    """A last line that was partially written is ignored, and does not swallow the next entry."""
+    path = tmp_path / "journal.jsonl"
+    journal = SubmissionJournal(path)
+    journal.record_submitted((1,), 10)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write('{"event":"submitted","extras":[2],"pk":1')
+
+    journal = SubmissionJournal(path)
+    assert journal.get_uncommitted() == {10: ((1,), None)}
+
+    journal.record_submitted((3,), 12)
+    journal.close()
+    assert SubmissionJournal(path).get_uncommitted() == {10: ((1,), None), 12: ((3,), None)}
+
+
+def test_compact(tmp_path):
+    """Compacting keeps only the uncommitted processes, and replaying the result gives the same state."""
+    path = tmp_path / "journal.jsonl"
+    journal = SubmissionJournal(path)
+    for pk in range(10):
+        journal.record_submitted((pk,), pk, attempt=2 if pk == 7 else None)
+    journal.record_committed([pk for pk in range(10) if pk not in (3, 7)])
+    journal.compact()
+
+    assert [json.loads(line)["pk"] for line in read_lines(path)] == [3, 7]
+    assert SubmissionJournal(path).get_uncommitted() == {3: ((3,), None), 7: ((7,), 2)}
+
+    journal.record_committed([3])
+    assert SubmissionJournal(path).get_uncommitted() == {7: ((7,), 2)}
+
+
+def test_compact_after_partial_last_line(tmp_path):
+    """Compacting a file whose last line was partially written drops that line."""
+    path = tmp_path / "journal.jsonl"
+    journal = SubmissionJournal(path)
+    journal.record_submitted((1,), 10)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write('{"event":"committed","pk":')
+
+    journal = SubmissionJournal(path)
+    journal.compact()
+    assert len(read_lines(path)) == 1
+    assert SubmissionJournal(path).get_uncommitted() == {10: ((1,), None)}
+
+
+def test_compact_above_max_size(tmp_path):
+    """The file is compacted after a commit once it is larger than ``max_size``."""
+    path = tmp_path / "journal.jsonl"
+    journal = SubmissionJournal(path, max_size=1000)
+    for pk in range(100):
+        journal.record_submitted((pk,), pk)
+        journal.record_committed([pk])
+        assert path.stat().st_size <= 1000
+    journal.record_submitted((100,), 100)
+
+    assert SubmissionJournal(path).get_uncommitted() == {100: ((100,), None)}